@@ -1,26 +1,172 @@
+import numpy as np
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator
+
 from utils import Chromosome, Cluster
 from utils import generateSampleCluster
 from objectiveFunc import (
-    uavEnergyConsumption,
-    clusterEnergyConsumption,
-    receivedSignalStrengthLoss,
+    parameters,
+    evaluatePopulation,
+    ShadowingSamples,
+    FitnessCache,
 )
 
 
 INFINITY = 1e20
 #! ASSUMING ALL THE OPTIMIZATION OBJECTIVES ARE OF MINIMIZATION
 
+# populations up to this size are ranked through the full domination matrix
+# (objective counts other than 3; those always use the sweep)
+DOMINATION_MATRIX_LIMIT = 1000
+
+
+def dominationMatrix(fitness: np.ndarray) -> np.ndarray:
+    """dominates[i, j] is True when individual i dominates individual j."""
+    notWorse = np.all(fitness[:, None, :] <= fitness[None, :, :], axis=2)
+    better = np.any(fitness[:, None, :] < fitness[None, :, :], axis=2)
+    return notWorse & better
+
+
+def matrixNonDominatedSort(fitness: np.ndarray) -> tuple[list[np.ndarray], np.ndarray]:
+    dominates = dominationMatrix(fitness)
+    dominatedBy = dominates.sum(axis=0)
+    ranks = np.full(len(fitness), -1)
+
+    # peel fronts: the undominated individuals form a front and stop counting against the rest
+    fronts = []
+    front = np.flatnonzero(dominatedBy == 0)
+    while len(front):
+        ranks[front] = len(fronts)
+        fronts.append(front)
+        dominatedBy -= dominates[front].sum(axis=0)
+        dominatedBy[front] = -1
+        front = np.flatnonzero(dominatedBy == 0)
+    return fronts, ranks
+
+
+def efficientNonDominatedSort(fitness: np.ndarray) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    Efficient Non-dominated Sort with binary search (ENS-BS). After a lexicographic sort no
+    individual can be dominated by a later one, so each is placed, in that order, into the
+    first front none of whose members dominates it; fronts are searched by bisection.
+    """
+    populationSize, objectiveCount = fitness.shape
+    order = np.lexsort(fitness.T[::-1])
+    ranks = np.empty(populationSize, dtype=int)
+
+    # each front's members are kept in a growable (capacity x M) buffer
+    members, memberCounts, frontIndices = [], [], []
+    for index in order:
+        individual = fitness[index]
+        low, high = 0, len(members)
+        while low < high:
+            middle = (low + high) // 2
+            block = members[middle][: memberCounts[middle]]
+            if np.any(np.all(block <= individual, axis=1) & np.any(block < individual, axis=1)):
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(members):
+            members.append(np.empty((16, objectiveCount)))
+            memberCounts.append(0)
+            frontIndices.append([])
+        elif memberCounts[low] == len(members[low]):
+            members[low] = np.concatenate([members[low], np.empty_like(members[low])])
+        members[low][memberCounts[low]] = individual
+        memberCounts[low] += 1
+        frontIndices[low].append(index)
+        ranks[index] = low
+
+    return [np.sort(front) for front in frontIndices], ranks
+
+
+def sweepNonDominatedSort(fitness: np.ndarray) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    ENS-BS specialised to 3 objectives. Sorted on the first objective, a front dominates the next
+    individual exactly when one of its members is no worse on the other two, so each front only
+    keeps its 2D staircase in (f2, f3) and every dominance test becomes a bisection.
+    """
+    # identical rows share a rank and would otherwise look like dominance in the staircase
+    unique, inverse = np.unique(fitness, axis=0, return_inverse=True)
+    uniqueRanks = np.empty(len(unique), dtype=int)
+
+    # staircase k: f2 ascending with -f3 ascending (f3 strictly falling)
+    stairF2, stairNegF3 = [], []
+    for index, (_, f2, f3) in enumerate(unique.tolist()):
+        low, high = 0, len(stairF2)
+        while low < high:
+            middle = (low + high) // 2
+            position = bisect_right(stairF2[middle], f2)
+            if position and -stairNegF3[middle][position - 1] <= f3:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(stairF2):
+            stairF2.append([])
+            stairNegF3.append([])
+        # the new point replaces the staircase points it covers
+        position = bisect_left(stairF2[low], f2)
+        end = bisect_right(stairNegF3[low], -f3, lo=position)
+        stairF2[low][position:end] = [f2]
+        stairNegF3[low][position:end] = [-f3]
+        uniqueRanks[index] = low
+
+    ranks = uniqueRanks[inverse.ravel()]
+    order = np.argsort(ranks, kind="stable")
+    fronts = np.split(order, np.flatnonzero(np.diff(ranks[order])) + 1)
+    return fronts, ranks
+
+
+def crowdingDistance(fitness: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+    """Crowding distance of every individual within its own front; front boundaries get infinity."""
+    distance = np.zeros(len(fitness))
+    for objective in range(fitness.shape[1]):
+        # individuals grouped by front, each front sorted on this objective
+        order = np.lexsort((fitness[:, objective], ranks))
+        values, sortedRanks = fitness[order, objective], ranks[order]
+        first = np.r_[True, sortedRanks[1:] != sortedRanks[:-1]]
+        last = np.r_[sortedRanks[1:] != sortedRanks[:-1], True]
+        span = (values[last] - values[first])[np.cumsum(first) - 1]
+
+        gap = np.full(len(values), np.inf)
+        interior = ~(first | last)
+        gap[interior] = np.divide(
+            values[2:][interior[1:-1]] - values[:-2][interior[1:-1]],
+            span[interior],
+            out=np.zeros(np.count_nonzero(interior)),
+            where=span[interior] > 0,
+        )
+        distance[order] += gap
+    return distance
+
+
+def nonDominatedSort(fitness: np.ndarray, matrixLimit: int = DOMINATION_MATRIX_LIMIT) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    Ranks a (pop x objectives) fitness matrix, all objectives minimised.
+    Returns the fronts, best first, as arrays of population indices, and each individual's front rank.
+    """
+    fitness = np.asarray(fitness, dtype=np.float64)
+    if len(fitness) == 0:
+        return [], np.empty(0, dtype=int)
+    # with 3 objectives the sweep is the faster path at every population size
+    if fitness.shape[1] == 3:
+        return sweepNonDominatedSort(fitness)
+    if len(fitness) <= matrixLimit:
+        return matrixNonDominatedSort(fitness)
+    return efficientNonDominatedSort(fitness)
+
 
 class nsga2:
     def __init__(self, currentLoc: Chromosome, cluster: Cluster) -> None:
         self.currentLoc = currentLoc
         self.cluster = cluster
-        lowerBoundX = min([device.location[0] for device in cluster.IoTDevices])
-        lowerBoundY = min([device.location[1] for device in cluster.IoTDevices])
-        lowerBoundZ = min([device.location[2] for device in cluster.IoTDevices])
-        upperBoundX = max([device.location[0] for device in cluster.IoTDevices])
-        upperBoundY = max([device.location[1] for device in cluster.IoTDevices])
-        upperBoundZ = max([device.location[2] for device in cluster.IoTDevices])
+        nodes = cluster.columns()
+        lowerBoundX, upperBoundX = nodes.x.min(), nodes.x.max()
+        lowerBoundY, upperBoundY = nodes.y.min(), nodes.y.max()
+        lowerBoundZ, upperBoundZ = nodes.z.min(), nodes.z.max()
 
         if lowerBoundZ == upperBoundZ == 0:
             lowerBoundZ = INFINITY
@@ -29,62 +175,196 @@ class nsga2:
         self.lowerBound = min([lowerBoundX, lowerBoundY, lowerBoundZ])
         self.upperBound = max([upperBoundX, upperBoundY, upperBoundZ])
         self.set = False  # used to check if population is set or not
+        self.shadowing, self.fitnessCache = None, None
+
+    def enableDeterministicFitness(
+        self, seed: int = None, perGeneration: bool = False, cacheSize: int = 100_000, quantum: float = 1e-6
+    ) -> None:
+        """
+        Scores every individual against fixed shadowing samples (redrawn each generation when
+        perGeneration is set) and memoises fitness in an LRU cache of "cacheSize" quantised gene rows.
+        """
+        self.shadowing = ShadowingSamples(self.cluster.size(), seed, perGeneration)
+        self.fitnessCache = FitnessCache(cacheSize, quantum) if cacheSize else None
+
+    def evaluate(self, genes: np.ndarray) -> np.ndarray:
+        shadowing = None if self.shadowing is None else self.shadowing.samples
+
+        def evaluator(rows: np.ndarray) -> np.ndarray:
+            return evaluatePopulation(rows, self.currentLoc.genes, self.cluster.columns(), shadowing=shadowing)
+
+        if self.fitnessCache is None:
+            return evaluator(genes)
+        return self.fitnessCache.evaluate(genes, evaluator)
 
     def initializePopulation(
         self, popSize: int, geneCount: int, LB: float, UB: float
     ) -> None:
-        self.population = [Chromosome(geneCount, LB, UB) for _ in popSize]
+        # the population lives in contiguous arrays: parents in the first popSize rows of the
+        # combined buffers, offspring in the rest, so survival never allocates new individuals
         self.popSize, self.genCount = popSize, geneCount
         self.lowerBound, self.upperBound = LB, UB
+        self.combinedGenes = np.empty((2 * popSize, geneCount))
+        self.combinedFitness = np.empty((2 * popSize, 3))
+        self.survivorGenes = np.empty((popSize, geneCount))
+        self.survivorFitness = np.empty((popSize, 3))
+        self.genes, self.fitness = self.combinedGenes[:popSize], self.combinedFitness[:popSize]
+        self.offspringGenes, self.offspringFitness = self.combinedGenes[popSize:], self.combinedFitness[popSize:]
+
+        self.genes[...] = LB + np.random.random((popSize, geneCount)) * (UB - LB)
         self.set = True
 
+    @property
+    def population(self) -> list[Chromosome]:
+        return [Chromosome.fromGenes(genes, fitness) for genes, fitness in zip(self.genes.tolist(), self.fitness.tolist())]
+
     def estimateFitness(self) -> None:
         """Set fitness of each individual of the population"""
         if not self.set:
             return
 
-        for i in range(self.popSize):
-            fitness = [
-                uavEnergyConsumption(self.population[i], self.currentLoc),
-                clusterEnergyConsumption(self.cluster, self.population[i]),
-                receivedSignalStrengthLoss(self.cluster, self.population[i]),
-            ]
-            self.population[i].setFitness(fitness)
-
-    def nonDominationSorting(self) -> None:
-        #!----------- INCOMPLETE -----------!#
-        def anySuperior(j, i):
-            jFitness, iFitness = self.population[j].fitness, self.population[i].fitness
-            for pair in zip(jFitness, iFitness):
-                if pair[0] > pair[1]:
-                    return True
-            return False
-
-        def anyInferior(j, i):
-            jFitness, iFitness = self.population[j].fitness, self.population[i].fitness
-            for pair in zip(jFitness, iFitness):
-                if pair[0] < pair[1]:
-                    return True
-            return False
+        # all three objectives for the whole population in one batched call
+        self.fitness[...] = self.evaluate(self.genes)
 
+    def nonDominationSorting(self) -> tuple[list[np.ndarray], np.ndarray] | None:
+        """Fronts (population indices, best first) and the front rank of every individual."""
         if not self.set:
             return
 
-        for i in range(self.popSize):
-            for j in range(self.popSize):
-                if i == j:
-                    continue
-                if anySuperior(j, i) and not anyInferior(j, i):
-                    pass  # mark x_i as dominated
+        self.fronts, self.ranks = nonDominatedSort(self.fitness)
+        return self.fronts, self.ranks
+
+    def tournamentSelection(self, count: int) -> np.ndarray:
+        """Indices of "count" parents, each the winner of a binary tournament on (rank, crowding)."""
+        contestants = np.random.randint(self.popSize, size=(count, 2))
+        first, second = contestants[:, 0], contestants[:, 1]
+        secondWins = (self.ranks[second] < self.ranks[first]) | (
+            (self.ranks[second] == self.ranks[first]) & (self.crowding[second] > self.crowding[first])
+        )
+        return np.where(secondWins, second, first)
+
+    def crossover(self, parents: np.ndarray, crossoverProb: float, etaC: float) -> None:
+        """Simulated binary crossover of consecutive parent pairs into the offspring buffer."""
+        pairCount = (self.popSize + 1) // 2
+        first, second = self.genes[parents[:pairCount]], self.genes[parents[pairCount:]]
+
+        u = np.random.random(first.shape)
+        beta = np.where(u <= 0.5, (2 * u) ** (1 / (etaC + 1)), (1 / (2 * (1 - u))) ** (1 / (etaC + 1)))
+        # each pair crosses with crossoverProb, and then each gene with probability 0.5
+        crosses = (np.random.random((pairCount, 1)) < crossoverProb) & (np.random.random(first.shape) < 0.5)
+        beta = np.where(crosses, beta, 1.0)
+
+        children = np.concatenate([
+            0.5 * ((1 + beta) * first + (1 - beta) * second),
+            0.5 * ((1 - beta) * first + (1 + beta) * second),
+        ])
+        np.clip(children[: self.popSize], self.lowerBound, self.upperBound, out=self.offspringGenes)
+
+    def mutate(self, mutationProb: float, etaM: float) -> None:
+        """Polynomial mutation of the offspring buffer, in place."""
+        u = np.random.random(self.offspringGenes.shape)
+        delta = np.where(u < 0.5, (2 * u) ** (1 / (etaM + 1)) - 1, 1 - (2 * (1 - u)) ** (1 / (etaM + 1)))
+        mutates = np.random.random(self.offspringGenes.shape) < mutationProb
+        self.offspringGenes += np.where(mutates, delta * (self.upperBound - self.lowerBound), 0.0)
+        np.clip(self.offspringGenes, self.lowerBound, self.upperBound, out=self.offspringGenes)
 
-    def run(self, Tmax: int, popSize: int = None, geneCount: int = None):
+    def survival(self) -> None:
+        """Elitist survival: the best popSize of parents and offspring by (rank, -crowding) become the parents."""
+        _, ranks = nonDominatedSort(self.combinedFitness)
+        crowding = crowdingDistance(self.combinedFitness, ranks)
+        survivors = np.lexsort((-crowding, ranks))[: self.popSize]
+
+        np.take(self.combinedGenes, survivors, axis=0, out=self.survivorGenes)
+        np.take(self.combinedFitness, survivors, axis=0, out=self.survivorFitness)
+        self.genes[...], self.fitness[...] = self.survivorGenes, self.survivorFitness
+        self.ranks, self.crowding = ranks[survivors], crowding[survivors]
+
+    def paretoFront(self) -> list[Chromosome]:
+        """UAV hovering positions of the current first front, with their fitness."""
+        front = np.flatnonzero(self.ranks == 0)
+        return [Chromosome.fromGenes(self.genes[i].tolist(), self.fitness[i].tolist()) for i in front]
+
+    def run(
+        self,
+        Tmax: int,
+        popSize: int = None,
+        geneCount: int = None,
+        crossoverProb: float = 0.9,
+        mutationProb: float = None,
+        etaC: float = 15.0,
+        etaM: float = 20.0,
+    ) -> list[Chromosome] | None:
+        """Runs Tmax generations of NSGA-II and returns the final Pareto front."""
         if not self.set and (not popSize or not geneCount):
             return
         if not self.set:
             self.initializePopulation(
                 popSize, geneCount, self.lowerBound, self.upperBound
             )
+        mutationProb = 1 / self.genCount if mutationProb is None else mutationProb
+
         self.estimateFitness()
+        self.nonDominationSorting()
+        self.crowding = crowdingDistance(self.fitness, self.ranks)
+        for generation in range(Tmax):
+            if generation and self.shadowing is not None and self.shadowing.nextGeneration():
+                # new noise: cached scores are stale and the parents are re-scored against it
+                if self.fitnessCache is not None:
+                    self.fitnessCache.clear()
+                self.estimateFitness()
+                self.nonDominationSorting()
+                self.crowding = crowdingDistance(self.fitness, self.ranks)
+
+            parents = self.tournamentSelection(2 * ((self.popSize + 1) // 2))
+            self.crossover(parents, crossoverProb, etaC)
+            self.mutate(mutationProb, etaM)
+            self.offspringFitness[...] = self.evaluate(self.offspringGenes)
+            self.survival()
+
+        return self.paretoFront()
+
+
+def optimiseCluster(task: tuple) -> tuple[int, list[Chromosome]]:
+    # runs in a worker: the cluster arrives once, as node columns, and the whole NSGA-II run happens here
+    index, nodes, currentGenes, settings, seed, objectiveParameters, fitnessOptions = task
+    np.random.seed(seed)
+    parameters.update(objectiveParameters)
+    optimiser = nsga2(Chromosome.fromGenes(currentGenes), Cluster.fromColumns(nodes))
+    if fitnessOptions is not None:
+        optimiser.enableDeterministicFitness(**{"seed": seed, **fitnessOptions})
+    return index, optimiser.run(**settings)
+
+
+def optimiseClusters(
+    clusters: list[tuple[Cluster, Chromosome]],
+    Tmax: int,
+    popSize: int,
+    geneCount: int = 3,
+    workers: int = None,
+    seed: int = None,
+    fitnessOptions: dict = None,
+    **options,
+) -> Iterator[tuple[int, list[Chromosome]]]:
+    """
+    Optimises the hovering point of every (cluster, current UAV location) pair in a process pool.
+    Yields (cluster index, Pareto front) as each cluster finishes, so results arrive out of order.
+    fitnessOptions, when given, go to nsga2.enableDeterministicFitness (seed defaults to the cluster's);
+    options are passed on to nsga2.run (crossoverProb, mutationProb, etaC, etaM).
+    """
+    settings = dict(Tmax=Tmax, popSize=popSize, geneCount=geneCount, **options)
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(clusters))]
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            pool.submit(optimiseCluster, (index, cluster.columns(), currentLoc.genes, settings, seeds[index], dict(parameters), fitnessOptions))
+            for index, (cluster, currentLoc) in enumerate(clusters)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # a consumer that stops early should not wait for the clusters it no longer wants
+        pool.shutdown(cancel_futures=True)
 
 
 def __main__():
@@ -1,7 +1,9 @@
 import random
+import numpy as np
+from collections import OrderedDict
 
 from math import sqrt, log10, pi
-from utils import Chromosome, Node, Cluster
+from utils import Chromosome, Node, Cluster, NodeColumns
 
 parameters = {
     "horizontalVelocity": 1,  # meter/second --> UAV horizontal-velocity
@@ -82,21 +84,24 @@ def clusterEnergyConsumption(cluster: Cluster, sink: Chromosome) -> float:
 # at UAV, the average signal strength lost at UAV is calculated.
 
 
-def receivedSignalStrengthLoss(cluster: Cluster, sink: Chromosome):
-    """average Received Signal Strength loss at UAV located at "Sink"."""
+def receivedSignalStrengthLoss(cluster: Cluster, sink: Chromosome, shadowing: np.ndarray = None):
+    """
+    average Received Signal Strength loss at UAV located at "Sink".
+    "shadowing" fixes each node's G_sigma (see ShadowingSamples); by default it is drawn afresh.
+    """
     # RSSI = sum ( P_t - 20log10(4pi*D0*f/C) - 10eta*log10(dist/D0) - G_signma ) / m
     # RSSI = sum (P_t - loss) / m
     m = cluster.size()
 
     loss = 0.0
-    for node in cluster.IoTDevices:
+    for i, node in enumerate(cluster.IoTDevices):
         dist = sqrt(
             (sink.genes[0] - node.location[0]) ** 2
             + (sink.genes[1] - node.location[1]) ** 2
             + (sink.genes[2] - node.location[2]) ** 2
         )
         # calculating Gaussian Noise
-        G_sigma = random.gauss(0, parameters["signma"])
+        G_sigma = random.gauss(0, parameters["signma"]) if shadowing is None else shadowing[i]
 
         loss += (
             20 * log10(4 * pi * parameters["D0"] * node.freq / parameters["C"])
@@ -108,6 +113,141 @@ def receivedSignalStrengthLoss(cluster: Cluster, sink: Chromosome):
     return loss
 
 
+# Batched versions: the population is a (pop x 3) array of sink locations and the cluster
+# its NodeColumns; each objective returns one value per individual.
+
+
+def squaredDistances(sinks: np.ndarray, nodes: NodeColumns) -> np.ndarray:
+    """(pop x m) squared distances between every sink and every node, accumulated one axis at a time."""
+    squared = (sinks[:, 0, None] - nodes.x) ** 2
+    squared += (sinks[:, 1, None] - nodes.y) ** 2
+    squared += (sinks[:, 2, None] - nodes.z) ** 2
+    return squared
+
+
+def uavEnergyConsumptionBatch(targets: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """uavEnergyConsumption from "current" to every row of "targets" (pop x 3)."""
+    targets, current = np.asarray(targets, dtype=np.float64), np.asarray(current, dtype=np.float64)
+    horizontalDist = np.hypot(targets[:, 0] - current[0], targets[:, 1] - current[1])
+    consumption = 308.709 * (horizontalDist / parameters["horizontalVelocity"]) - 0.852
+
+    climb = targets[:, 2] - current[2]
+    consumption += np.where(climb > 0, 315 * climb - 0.852, 0.0)  # moving up
+    consumption += np.where(climb < 0, 68.956 * -climb - 65.183, 0.0)  # moving down
+    return consumption
+
+
+def clusterEnergyConsumptionBatch(nodes: NodeColumns, sinks: np.ndarray, squared: np.ndarray = None) -> np.ndarray:
+    """clusterEnergyConsumption of the cluster for every sink row of "sinks" (pop x 3)."""
+    E_elec, e_fs, e_mp = parameters["E_elec"], parameters["e_fs"], parameters["e_mp"]
+    if squared is None:
+        squared = squaredDistances(sinks, nodes)
+
+    # dist < d0  <=>  dist^2 < e_fs / e_mp
+    amplifier = np.where(squared < e_fs / e_mp, e_fs * squared, e_mp * squared**2)
+    return nodes.k.sum() * E_elec + amplifier @ nodes.k
+
+
+def receivedSignalStrengthLossBatch(nodes: NodeColumns, sinks: np.ndarray, squared: np.ndarray = None, shadowing: np.ndarray = None) -> np.ndarray:
+    """receivedSignalStrengthLoss of the cluster for every sink row of "sinks" (pop x 3)."""
+    D0, C, eta, sigma = parameters["D0"], parameters["C"], parameters["eta"], parameters["signma"]
+    m = nodes.size()
+    if squared is None:
+        squared = squaredDistances(sinks, nodes)
+
+    # the frequency term does not depend on the sink; log10(dist/D0) = log10(dist^2/D0^2) / 2
+    frequencyLoss = 20 * np.log10(4 * pi * D0 * nodes.freq / C).sum()
+    distanceLoss = 5 * eta * np.log10(squared / D0**2).sum(axis=1)
+    if shadowing is not None:
+        # fixed per-node samples: every sink sees the same noise
+        return (frequencyLoss + distanceLoss) / m + shadowing.mean()
+    # the mean of m independent N(0, sigma) shadowing samples is one N(0, sigma/sqrt(m)) draw
+    return (frequencyLoss + distanceLoss) / m + np.random.normal(0, sigma / sqrt(m), len(squared))
+
+
+def evaluatePopulation(population: np.ndarray, current: np.ndarray, nodes: NodeColumns, chunkSize: int = None, shadowing: np.ndarray = None) -> np.ndarray:
+    """
+    (pop x 3) fitness matrix [uavEnergyConsumption, clusterEnergyConsumption, receivedSignalStrengthLoss]
+    for a (pop x 3) population of sink locations; node distances are shared by the last two objectives
+    and computed "chunkSize" individuals at a time (default: about 4M distances per chunk).
+    """
+    population = np.asarray(population, dtype=np.float64)
+    chunkSize = chunkSize or max(1, (1 << 22) // max(nodes.size(), 1))
+
+    fitness = np.empty((len(population), 3))
+    fitness[:, 0] = uavEnergyConsumptionBatch(population, current)
+    for first in range(0, len(population), chunkSize):
+        sinks = population[first : first + chunkSize]
+        squared = squaredDistances(sinks, nodes)
+        fitness[first : first + chunkSize, 1] = clusterEnergyConsumptionBatch(nodes, sinks, squared)
+        fitness[first : first + chunkSize, 2] = receivedSignalStrengthLossBatch(nodes, sinks, squared, shadowing)
+    return fitness
+
+
+class ShadowingSamples:
+    """
+    Per-node shadowing samples G_sigma from a seeded stream (common random numbers): one set for
+    the whole run, or a new set every generation, so identical individuals score identically.
+    """
+
+    def __init__(self, nodeCount: int, seed: int = None, perGeneration: bool = False) -> None:
+        self.generator = np.random.default_rng(seed)
+        self.nodeCount, self.perGeneration = nodeCount, perGeneration
+        self.draw()
+
+    def draw(self) -> None:
+        self.samples = self.generator.normal(0, parameters["signma"], self.nodeCount)
+
+    def nextGeneration(self) -> bool:
+        """Draws the next generation's samples in per-generation mode; returns whether they changed."""
+        if self.perGeneration:
+            self.draw()
+        return self.perGeneration
+
+
+class FitnessCache:
+    """
+    Bounded LRU cache of fitness rows keyed by genes quantised to "quantum", so duplicated and
+    surviving individuals are scored once. Only valid while the objectives are deterministic.
+    """
+
+    def __init__(self, maxSize: int = 100_000, quantum: float = 1e-6) -> None:
+        self.maxSize, self.quantum = maxSize, quantum
+        self.entries = OrderedDict[bytes, np.ndarray]()
+        self.hits, self.misses = 0, 0
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def evaluate(self, population: np.ndarray, evaluator) -> np.ndarray:
+        """Fitness of every row of "population"; only rows not in the cache reach evaluator(rows)."""
+        quantised = np.round(np.asarray(population, dtype=np.float64) / self.quantum).astype(np.int64)
+        keys = [row.tobytes() for row in quantised]
+
+        fitness = np.empty((len(keys), 3))
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.entries.get(key)
+            if cached is None:
+                missing.append(i)
+                continue
+            self.entries.move_to_end(key)
+            fitness[i] = cached
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # repeats among the misses are scored once as well
+            _, first, inverse = np.unique(quantised[missing], axis=0, return_index=True, return_inverse=True)
+            scored = evaluator(np.asarray(population, dtype=np.float64)[np.array(missing)[first]])
+            fitness[missing] = scored[inverse.ravel()]
+            for row, i in zip(scored, np.array(missing)[first]):
+                self.entries[keys[i]] = row
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        return fitness
+
+
 if __name__ == "__main__":
     print(parameters["horizontalVelocity"])
     changeParameter("horizontalVelocity", 10.4)
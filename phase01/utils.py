@@ -1,10 +1,18 @@
 import random, datetime
+import numpy as np
 
 class Chromosome:
     def __init__(self, geneCount:int, LB:float, UB:float) -> None:
-        self.genes = [random.random() * (UB-LB) + LB for _ in geneCount]
+        self.genes = [random.random() * (UB-LB) + LB for _ in range(geneCount)]
         self.fitness = []
 
+    @staticmethod
+    def fromGenes(genes: list[float], fitness: list[float] = None) -> "Chromosome":
+        chromosome = Chromosome(0, 0, 0)
+        chromosome.genes = list(genes)
+        chromosome.fitness = [] if fitness is None else list(fitness)
+        return chromosome
+
     def geneCount(self) -> int:
         return len(self.genes)
     
@@ -24,12 +32,44 @@ class Node:
         self.freq = frequency
         
         
+class NodeColumns:
+    def __init__(self, x: np.ndarray, y: np.ndarray, z: np.ndarray, k: np.ndarray, freq: np.ndarray) -> None:
+        """Struct-of-arrays form of a cluster: one column per node attribute, indexed by node."""
+        self.x, self.y, self.z = x, y, z
+        self.k = k
+        self.freq = freq
+    
+    def size(self) -> int:
+        return len(self.x)
+        
+
 class Cluster:
     def __init__(self, IoTDevices: list[Node]) -> None:
         self.IoTDevices = IoTDevices
+        self.nodeColumns = None
         
     def size(self):
+        if not self.IoTDevices and self.nodeColumns is not None:
+            return self.nodeColumns.size()
         return len(self.IoTDevices)
+    
+    @staticmethod
+    def fromColumns(columns: NodeColumns) -> "Cluster":
+        """Cluster known only by its node columns, e.g. after being shipped to a worker process."""
+        cluster = Cluster([])
+        cluster.nodeColumns = columns
+        return cluster
+    
+    def columns(self) -> NodeColumns:
+        # built once and reused by the batched objectives; IoTDevices is not expected to change afterwards
+        if self.nodeColumns is None:
+            locations = np.array([node.location for node in self.IoTDevices], dtype=np.float64).reshape(-1, 3)
+            self.nodeColumns = NodeColumns(
+                locations[:, 0].copy(), locations[:, 1].copy(), locations[:, 2].copy(),
+                np.array([node.k for node in self.IoTDevices], dtype=np.float64),
+                np.array([node.freq for node in self.IoTDevices], dtype=np.float64),
+            )
+        return self.nodeColumns
 
 
 def generateSampleCluster(LB: float, UB: float, hasZ: bool=False) -> str:
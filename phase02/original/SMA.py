@@ -1,10 +1,20 @@
 import numpy as np
 import argparse
+import multiprocessing as mp
 from os import path
 from datetime import datetime
 from math import exp
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+from scipy.sparse import csr_matrix, diags, issparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu, spilu, cg, LinearOperator
 
 from utils import readPoints, plotweights, printMatrix
+from convergence import StoppingCriteria
+from geometry import pairwiseDistance, fluxKernel, defaultChunkSize
+from checkpoint import saveCheckpoint, loadCheckpoint
+from sharedMemory import attachShared, createShared
+from instrumentation import PhaseTimer, NULL_TIMER
 
 
 def gammaFunc(a: float, b: float, c: float, T: int, t: int) -> float:
@@ -34,113 +44,571 @@ class SlimeMould:
         self.totalFlux = totalFlux
         self.distance = distanceMatrix
         if distanceMatrix is None:
-            self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
-            self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
-        
-            self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
-        
-            for i in range(self.totalPoints):
-                for j in range(self.totalPoints):
-                    self.distance[i, j] = np.sqrt(np.sum((points[i] - points[j]) ** 2))
+            self.distance = pairwiseDistance(points)
         
         self.conductivity = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64) * intialConductivity
+        self.pruneThreshold, self.sparseDensity = None, None
+        self.sparse = False
+        self.pressure = None
+        self.solverTolerance = None
         
     
-    def calculatePressure(self) -> None:
-        # Calculating Pressure at each Node
-        for i in range(self.totalPoints): self.distance[i][i] = 1
-        
-        # Element-wise division to obtain Dij/Lij
-        self.pressureCoeff = self.conductivity / self.distance
-        
-        for i in range(self.totalPoints):
-            self.distance[i][i] = 0
-            self.pressureCoeff[i][i] = 0
+    def enablePruning(self, pruneThreshold: float, sparseDensity: float = 0.1) -> None:
+        # tubes whose conductivity decays below "pruneThreshold" are removed; once the fraction
+        # of tubes left drops below "sparseDensity", conductivity, pressure and flux go to CSR
+        self.pruneThreshold, self.sparseDensity = pruneThreshold, sparseDensity
+    
+    
+    def enableIterativeSolver(self, tolerance: float = 1e-8, preconditionerReuse: int = 10, maxSolverIterations: int = 50) -> None:
+        # pressures come from preconditioned conjugate gradient started at the previous
+        # iteration's pressures; the preconditioner (Jacobi when dense, incomplete LU when
+        # pruned to CSR) is rebuilt once it is "preconditionerReuse" iterations old
+        self.solverTolerance, self.preconditionerReuse = tolerance, preconditionerReuse
+        self.maxSolverIterations = maxSolverIterations
+        self.preconditioner, self.preconditionerAge = None, 0
+        self.preconditionerActive, self.preconditionerSparse = None, None
+        self.solverIterations = list[int]()
+    
+    
+    def tubeDensity(self) -> float:
+        tubes = self.conductivity.nnz if self.sparse else np.count_nonzero(self.conductivity) - np.count_nonzero(self.conductivity.diagonal())
+        return tubes / (self.totalPoints * (self.totalPoints - 1))
+    
+    
+    def pruneTubes(self) -> None:
+        if self.sparse:
+            self.conductivity.data[self.conductivity.data < self.pruneThreshold] = 0
+            self.conductivity.eliminate_zeros()
+            return
         
-        for i in range(self.totalPoints):
-            self.pressureCoeff[i][i] -= sum(self.pressureCoeff[i])
+        self.conductivity[self.conductivity < self.pruneThreshold] = 0
+        if self.tubeDensity() <= self.sparseDensity:
+            # the diagonal never carries flux, so it is left out of the sparse network
+            np.fill_diagonal(self.conductivity, 0)
+            self.conductivity = csr_matrix(self.conductivity)
+            self.sparse = True
+    
+    
+    def tubeEnds(self) -> tuple[np.ndarray, np.ndarray]:
+        # row and column of every stored tube, in CSR data order
+        rows = np.repeat(np.arange(self.totalPoints), np.diff(self.conductivity.indptr))
+        return rows, self.conductivity.indices
+    
+    
+    def calculatePressure(self) -> None:
+        if self.sparse:
+            return self.calculateSparsePressure()
         
+        # Element-wise division to obtain Dij/Lij; the shared distance matrix is only read
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.pressureCoeff = self.conductivity / self.distance
+        np.fill_diagonal(self.pressureCoeff, 0)
+        np.fill_diagonal(self.pressureCoeff, -self.pressureCoeff.sum(axis=1))
+
         netFlux = np.zeros(self.totalPoints)
         netFlux[self.startPoint] = -self.totalFlux
         netFlux[self.endPoint] = self.totalFlux
-    
-        self.pressure = np.linalg.lstsq(self.pressureCoeff, netFlux, rcond=None)[0]
-            
-    
+
+        # only points connected to the end point take part; the end point itself is grounded
+        # (p = 0), which removes the Laplacian's null space and leaves an SPD system
+        _, component = connected_components(self.pressureCoeff != 0, directed=False)
+        active = component == component[self.endPoint]
+        if not active[self.startPoint]:
+            raise PressureCoeffSingular(f"no tube path between points {self.startPoint} and {self.endPoint}")
+        active[self.endPoint] = False
+
+        active = np.flatnonzero(active)
+        pressure = self.solveGrounded(-self.pressureCoeff[np.ix_(active, active)], -netFlux[active], active)
+        self.pressure = np.zeros(self.totalPoints)
+        self.pressure[active] = pressure
+
+    def calculateSparsePressure(self) -> None:
+        # same grounded system as calculatePressure, but as a CSR Laplacian over the remaining tubes
+        rows, cols = self.tubeEnds()
+        self.pressureCoeff = self.conductivity.copy()
+        self.pressureCoeff.data /= self.distance[rows, cols]
+        laplacian = diags(np.asarray(self.pressureCoeff.sum(axis=1)).ravel()) - self.pressureCoeff
+
+        netFlux = np.zeros(self.totalPoints)
+        netFlux[self.startPoint] = -self.totalFlux
+        netFlux[self.endPoint] = self.totalFlux
+
+        _, component = connected_components(self.pressureCoeff, directed=False)
+        active = component == component[self.endPoint]
+        if not active[self.startPoint]:
+            raise PressureCoeffSingular(f"no tube path between points {self.startPoint} and {self.endPoint}")
+        active[self.endPoint] = False
+
+        active = np.flatnonzero(active)
+        pressure = self.solveGrounded(laplacian.tocsr()[active][:, active].tocsc(), -netFlux[active], active)
+        self.pressure = np.zeros(self.totalPoints)
+        self.pressure[active] = pressure
+
+    def factorise(self, grounded) -> callable:
+        # exact solve of a grounded system: Cholesky when dense, sparse LU when CSR
+        if issparse(grounded):
+            try:
+                factor = splu(grounded.tocsc())
+            except RuntimeError as error:
+                raise PressureCoeffSingular(f"grounded pressure system ({self.startPoint}, {self.endPoint}) is singular") from error
+            return factor.solve
+        try:
+            factor = cho_factor(grounded)
+        except LinAlgError as error:
+            raise PressureCoeffSingular(f"grounded pressure system ({self.startPoint}, {self.endPoint}) is not positive definite") from error
+        return lambda rhs: cho_solve(factor, rhs)
+
+    def buildPreconditioner(self, grounded) -> LinearOperator:
+        # far cheaper than factorise: a drop-tolerance ILU of the sparse system, or the inverse
+        # diagonal of the dense one, whose factor would cost as much as solving outright
+        if issparse(grounded):
+            try:
+                return LinearOperator(grounded.shape, matvec=spilu(grounded.tocsc(), drop_tol=1e-4, fill_factor=10).solve, dtype=np.float64)
+            except RuntimeError:
+                pass
+        inverseDiagonal = 1 / grounded.diagonal()
+        return LinearOperator(grounded.shape, matvec=lambda vector: inverseDiagonal * vector.ravel(), dtype=np.float64)
+
+    def solveGrounded(self, grounded, rhs: np.ndarray, active: np.ndarray) -> np.ndarray:
+        if self.solverTolerance is None:
+            return self.factorise(grounded)(rhs)
+
+        # a preconditioner only fits systems over the same points and storage
+        if self.preconditioner is None or self.preconditionerAge >= self.preconditionerReuse or self.preconditionerSparse != self.sparse or not np.array_equal(active, self.preconditionerActive):
+            self.preconditioner = self.buildPreconditioner(grounded)
+            self.preconditionerActive, self.preconditionerSparse, self.preconditionerAge = active, self.sparse, 0
+        self.preconditionerAge += 1
+
+        iterations = 0
+        def countIteration(_) -> None:
+            nonlocal iterations
+            iterations += 1
+
+        initialGuess = None if self.pressure is None else self.pressure[active]
+        pressure, info = cg(grounded, rhs, x0=initialGuess, rtol=self.solverTolerance, maxiter=self.maxSolverIterations, M=self.preconditioner, callback=countIteration)
+        if info != 0:
+            # no convergence in time: solve exactly and refresh the preconditioner
+            pressure = self.factorise(grounded)(rhs)
+            self.preconditioner, self.preconditionerAge = self.buildPreconditioner(grounded), 1
+        self.solverIterations.append(iterations)
+        return pressure
+
     def calculateFlux(self) -> None:
         # Qij = (Dij/Lij) * (pi - pj) 
-        self.flux = np.zeros((self.totalPoints, self.totalPoints))
-        for i in range(self.totalPoints):
-            for j in range(self.totalPoints):
-                if i == j: continue
-                self.flux[i][j] = self.conductivity[i][j] * (self.pressure[i] - self.pressure[j]) / self.distance[i][j]
+        if self.sparse:
+            # pressureCoeff shares the conductivity's sparsity pattern, so the flux does too
+            rows, cols = self.tubeEnds()
+            self.flux = self.pressureCoeff.copy()
+            self.flux.data *= self.pressure[rows] - self.pressure[cols]
+            return
+        self.flux = fluxKernel(self.conductivity, self.pressure, self.distance)
         
         
     def updateConductivity(self, contractionRate: float, fluxInfluence: float) -> None:
-        # Dij = mu * Qij + (1 - gamma) * Dij
-        self.conductivity = fluxInfluence * self.flux + (1 - contractionRate) * self.conductivity
+        # Dij = mu * |Qij| + (1 - gamma) * Dij, keeping the tube network symmetric;
+        # gammaFunc overshoots 1 just after t = T, and a tube cannot contract past zero
+        if self.sparse:
+            self.conductivity.data = fluxInfluence * np.abs(self.flux.data) + max(1 - contractionRate, 0.0) * self.conductivity.data
+        else:
+            self.conductivity = fluxInfluence * np.abs(self.flux) + max(1 - contractionRate, 0.0) * self.conductivity
+        if self.pruneThreshold is not None:
+            self.pruneTubes()
             
     
-    def simulate(self, maxIterations: int, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float, debug: bool=False) -> None:
+    def simulate(self, maxIterations: int, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float, debug: bool=False, stopping: StoppingCriteria=None, timer: PhaseTimer=None, callback=None) -> list[float]:
+        # timer: accumulates time per phase; callback(iteration, slimeMould) runs after each iteration
+        timer = timer or NULL_TIMER
+        timer.start()
         T = maxIterations / 3
+        totalFlux = []
+        self.stopReason = "maxIterations"
+        if stopping is not None: stopping.start()
         if debug: print("Initiating Simulation...")
         for t in range(maxIterations):
             if debug: print(f"Iteration No. {t}")
-            self.calculatePressure()
-            self.calculateFlux()
+            with timer.phase("calculatePressure"):
+                self.calculatePressure()
+            with timer.phase("calculateFlux"):
+                self.calculateFlux()
             
             # gamma = a[ 1 - 1/[a/(a-b) + (ce)^(T-t)] ]
             contractionRate = gammaFunc(minContractionRate, maxContractionRate, transitionRate, T, t)
-            self.updateConductivity(contractionRate, fluxInfluence)
-            print(f"Total Node Flux: {self.flux.sum()}")
+            with timer.phase("updateConductivity"):
+                self.updateConductivity(contractionRate, fluxInfluence)
+            # the flux is antisymmetric, so its plain sum is zero: record the flow through the
+            # tubes instead, each tube counted once
+            tubeFlux = abs(self.flux).sum()
+            totalFlux.append(tubeFlux / 2)
+            if debug: print(f"Total Tube Flux: {totalFlux[-1]}")
+            if debug and self.solverTolerance is not None: print(f"Solver Iterations: {self.solverIterations[-1]}")
+            if callback is not None: callback(t, self)
+
+            if stopping is not None and stopping.check(tubeFlux, self.conductivity):
+                self.stopReason = stopping.reason
+                if debug: print("Stopping:", self.stopReason)
+                break
+
+        return totalFlux
                 
 
 
+class BatchedSlimeMould:
+    # every subsystem of a MultiStateSlimeMould stacked into (S x N x N) arrays,
+    # so one iteration is a handful of array operations instead of S SlimeMould calls.
+    # With edgeList=True only the N(N-1)/2 upper-triangle tube values are stored per
+    # subsystem, (S x E), and dense systems are assembled "chunkSize" subsystems at a time.
+    def __init__(self, distance: np.ndarray, startPoints: np.ndarray, endPoints: np.ndarray, initialConductivity: float, totalFlux: float, edgeList: bool=False, dtype: type=np.float64, chunkSize: int=None) -> None:
+        self.distance = distance
+        self.totalPoints = len(distance)
+        self.startPoints, self.endPoints = np.asarray(startPoints), np.asarray(endPoints)
+        self.subSystemCount = len(self.startPoints)
+        self.totalFlux = totalFlux
+        self.edgeList, self.dtype = edgeList, dtype
+        self.chunkSize = chunkSize or defaultChunkSize(self.totalPoints)
+
+        with np.errstate(divide="ignore"):
+            self.inverseDistance = 1 / distance
+        np.fill_diagonal(self.inverseDistance, 0)
+
+        if edgeList:
+            self.edgeRows, self.edgeCols = np.triu_indices(self.totalPoints, 1)
+            self.edgeInverseDistance = self.inverseDistance[self.edgeRows, self.edgeCols]
+            self.conductivity = np.full((self.subSystemCount, len(self.edgeRows)), initialConductivity, dtype=dtype)
+        else:
+            self.conductivity = np.full((self.subSystemCount, self.totalPoints, self.totalPoints), initialConductivity, dtype=dtype)
+
+
+    @staticmethod
+    def projectedMemory(subSystemCount: int, totalPoints: int, edgeList: bool=False, dtype: type=np.float64, chunkSize: int=None) -> int:
+        """Estimated peak bytes of one iteration: stored conductivity and flux plus the float64 work arrays."""
+        itemSize = np.dtype(dtype).itemsize
+        square = totalPoints * totalPoints
+        if edgeList:
+            chunkSize = min(chunkSize or defaultChunkSize(totalPoints), subSystemCount)
+            return 2 * subSystemCount * (square - totalPoints) // 2 * itemSize + 3 * chunkSize * square * 8
+        return 2 * subSystemCount * square * itemSize + 3 * subSystemCount * square * 8
+
+
+    def solvePressure(self, pressureCoeff: np.ndarray, startPoints: np.ndarray, endPoints: np.ndarray) -> np.ndarray:
+        subSystems, diagonal = np.arange(len(pressureCoeff)), np.arange(self.totalPoints)
+
+        # Dij/Lij with a zero diagonal; the Laplacian puts the row sums back on the diagonal
+        laplacian = -pressureCoeff
+        degree = pressureCoeff.sum(axis=2)
+        if np.any(degree[subSystems, startPoints] == 0) or np.any(degree[subSystems, endPoints] == 0):
+            raise PressureCoeffSingular("an entry or exit point has no tubes left")
+        # tubeless points carry no flux: decouple them at zero pressure
+        laplacian[:, diagonal, diagonal] = np.where(degree == 0, 1.0, degree)
+
+        netFlux = np.zeros((len(pressureCoeff), self.totalPoints))
+        netFlux[subSystems, startPoints] = self.totalFlux
+
+        # ground each subsystem's end point (p = 0) by replacing its row and column with identity
+        laplacian[subSystems, endPoints, :] = 0
+        laplacian[subSystems, :, endPoints] = 0
+        laplacian[subSystems, endPoints, endPoints] = 1
+
+        try:
+            return np.linalg.solve(laplacian, netFlux[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError as error:
+            raise PressureCoeffSingular("a grounded pressure system is singular") from error
+
+
+    def calculatePressure(self) -> None:
+        self.pressureCoeff = self.conductivity * self.inverseDistance
+        self.pressure = self.solvePressure(self.pressureCoeff, self.startPoints, self.endPoints)
+
+
+    def calculateFlux(self) -> None:
+        # Qij = (Dij/Lij) * (pi - pj), for every subsystem at once
+        self.flux = (self.pressureCoeff * (self.pressure[:, :, None] - self.pressure[:, None, :])).astype(self.dtype, copy=False)
+
+
+    def updateConductivity(self, contractionRate: float, fluxInfluence: float) -> None:
+        self.conductivity = (fluxInfluence * np.abs(self.flux) + max(1 - contractionRate, 0.0) * self.conductivity).astype(self.dtype, copy=False)
+
+
+    def nextIteration(self, contractionRate: float, fluxInfluence: float) -> np.ndarray:
+        """
+        Advances every subsystem one iteration and returns the summed (N x N) edge flux;
+        fluxMagnitude is then the flow through every subsystem's tubes, each tube counted once.
+        """
+        if not self.edgeList:
+            self.calculatePressure()
+            self.calculateFlux()
+            self.updateConductivity(contractionRate, fluxInfluence)
+            self.fluxMagnitude = np.abs(self.flux).sum(dtype=np.float64) / 2
+            return self.flux.sum(axis=0, dtype=np.float64)
+
+        if not hasattr(self, "flux"):
+            self.flux = np.zeros_like(self.conductivity)
+        edgeFlux = np.zeros(len(self.edgeRows))
+        self.fluxMagnitude = 0.0
+        for first in range(0, self.subSystemCount, self.chunkSize):
+            chunk = slice(first, first + self.chunkSize)
+            edgeCoeff = self.conductivity[chunk].astype(np.float64) * self.edgeInverseDistance
+
+            pressureCoeff = np.zeros((len(edgeCoeff), self.totalPoints, self.totalPoints))
+            pressureCoeff[:, self.edgeRows, self.edgeCols] = edgeCoeff
+            pressureCoeff[:, self.edgeCols, self.edgeRows] = edgeCoeff
+            pressure = self.solvePressure(pressureCoeff, self.startPoints[chunk], self.endPoints[chunk])
+
+            flux = edgeCoeff * (pressure[:, self.edgeRows] - pressure[:, self.edgeCols])
+            self.flux[chunk] = flux
+            self.conductivity[chunk] = fluxInfluence * np.abs(flux) + max(1 - contractionRate, 0.0) * self.conductivity[chunk]
+            edgeFlux += flux.sum(axis=0)
+            self.fluxMagnitude += np.abs(flux).sum()
+
+        # the flux is antisymmetric: Qji = -Qij
+        netEdgeFlux = np.zeros((self.totalPoints, self.totalPoints))
+        netEdgeFlux[self.edgeRows, self.edgeCols] = edgeFlux
+        netEdgeFlux[self.edgeCols, self.edgeRows] = -edgeFlux
+        return netEdgeFlux
+
+
+def runSubSystemShard(points: np.ndarray, distanceName: str, setup: dict, shard: slice, connection) -> None:
+    # a worker keeps its shard of subsystems for the whole run and, on every "step" from
+    # the parent, advances them one iteration and answers with their partial netEdgeFlux
+    # and fluxMagnitude;
+    # "get" and "set" read and restore the shard's conductivities for checkpoints
+    distanceBlock, distance = attachShared(distanceName, (len(points), len(points)), np.float64)
+    mssm = None
+    try:
+        mssm = MultiStateSlimeMould(points, distance)
+        mssm.setupSimulation(**setup, shard=shard)
+        while True:
+            command, payload = connection.recv()
+            if command == "stop":
+                break
+            if command == "get":
+                connection.send(mssm.getConductivity())
+            elif command == "set":
+                mssm.restoreState(*payload)
+            else:
+                mssm.nextIteration()
+                connection.send((mssm.netEdgeFlux, mssm.fluxMagnitude))
+    except Exception as error:
+        # whatever went wrong is raised again in the parent at its next receive
+        connection.send(error)
+    finally:
+        mssm = distance = None
+        distanceBlock.close()
+        connection.close()
+
+
 class MultiStateSlimeMould:
-    def __init__(self, points: np.ndarray) -> None:
+    def __init__(self, points: np.ndarray, distanceMatrix: np.ndarray=None) -> None:
         self.points = points
         self.totalPoints = len(points)
-        self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
         
         # Pre-calculating distance matrix
-        for i in range(self.totalPoints):
-            for j in range(self.totalPoints):
-                self.distance[i, j] = np.sqrt(np.sum((points[i] - points[j]) ** 2))
+        self.distance = distanceMatrix
+        if distanceMatrix is None:
+            self.distance = pairwiseDistance(points)
+        self.workers = None
+    
+    
+    def __enter__(self) -> "MultiStateSlimeMould":
+        return self
+    
+    
+    def __exit__(self, *exception) -> None:
+        # with MultiStateSlimeMould(points) as mssm: ... never leaves worker processes behind
+        self.stopWorkers()
         
                 
-    def setupSimulation(self, maxIterations: int, initialConductivity: float, totalFlux: float, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float):
+    def entryExitPairs(self, pairs: str) -> tuple[np.ndarray, np.ndarray]:
+        # "ordered" runs a subsystem for every (i, j), i != j; "unordered" one per i < j
+        if pairs == "unordered":
+            return np.triu_indices(self.totalPoints, 1)
+        if pairs == "ordered":
+            return np.nonzero(~np.eye(self.totalPoints, dtype=bool))
+        raise ValueError(f"unknown entry/exit pairing: {pairs}")
+
+
+    def projectedMemory(self, batched: bool=False, pairs: str="ordered", edgeList: bool=False, dtype: type=np.float64, chunkSize: int=None) -> int:
+        subSystemCount = len(self.entryExitPairs(pairs)[0])
+        if batched or edgeList:
+            return BatchedSlimeMould.projectedMemory(subSystemCount, self.totalPoints, edgeList, dtype, chunkSize)
+        # each SlimeMould keeps conductivity, pressureCoeff and flux
+        return 3 * subSystemCount * self.totalPoints * self.totalPoints * 8
+
+
+    def setupSimulation(self, maxIterations: int, initialConductivity: float, totalFlux: float, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float, batched: bool=False, pairs: str="ordered", edgeList: bool=False, dtype: type=np.float64, chunkSize: int=None, memoryLimit: int=None, workers: int=None, shard: slice=None, debug: bool=False):
+        # workers: split the subsystems across this many processes (shard is the slice a worker owns)
         self.maxIterations, self.iterationCleared = maxIterations, 0
         self.initialConductivity = initialConductivity
         self.totalFlux, self.fluxInfluence = totalFlux, fluxInfluence
         self.minContractionRate, self.maxContractionRate = minContractionRate, maxContractionRate
         self.transitionRate = transitionRate
+        self.batched = batched or edgeList
+        self.timer = NULL_TIMER
+        
+        # reported before anything is allocated
+        self.projectedPeakMemory = self.projectedMemory(self.batched, pairs, edgeList, dtype, chunkSize)
+        if debug: print(f"Projected peak memory: {self.projectedPeakMemory / 2**20:.1f} MiB")
+        if memoryLimit is not None and self.projectedPeakMemory > memoryLimit:
+            raise MemoryError(f"projected peak memory {self.projectedPeakMemory} B exceeds the limit of {memoryLimit} B")
         
-        self.subSystems = list[SlimeMould]()
-        for i in range(self.totalPoints):
-            for j in range(self.totalPoints):
-                if i == j: continue
+        startPoints, endPoints = self.entryExitPairs(pairs)
+        if shard is not None:
+            startPoints, endPoints = startPoints[shard], endPoints[shard]
+        
+        self.stopWorkers()
+        if workers is not None and workers > 1:
+            setup = dict(maxIterations=maxIterations, initialConductivity=initialConductivity, totalFlux=totalFlux, fluxInfluence=fluxInfluence, minContractionRate=minContractionRate, maxContractionRate=maxContractionRate, transitionRate=transitionRate, batched=batched, pairs=pairs, edgeList=edgeList, dtype=dtype, chunkSize=chunkSize)
+            self.startWorkers(workers, len(startPoints), setup)
+        elif self.batched:
+            self.batch = BatchedSlimeMould(self.distance, startPoints, endPoints, initialConductivity, totalFlux, edgeList, dtype, chunkSize)
+        else:
+            self.subSystems = list[SlimeMould]()
+            for i, j in zip(startPoints, endPoints):
                 self.subSystems.append(SlimeMould(self.points, i, j, initialConductivity, totalFlux, self.distance))
         
         # Qij(t) = sum^{N(N-1)/2}_{k=1} (Qij^m(t))
         self.netEdgeFlux = np.zeros((self.totalPoints, self.totalPoints), dtype=np.float64)
+        # ordered pairs run i -> j and j -> i, whose fluxes cancel in netEdgeFlux; the flow
+        # through every subsystem's tubes, each tube counted once, does not
+        self.fluxMagnitude = 0.0
+    
+    
+    def startWorkers(self, workerCount: int, subSystemCount: int, setup: dict) -> None:
+        # the distance matrix is shared, the conductivities stay with the worker that owns them
+        self.distanceBlock, distance = createShared(self.distance.shape, np.float64)
+        distance[...] = self.distance
+        
+        self.shardBounds = np.linspace(0, subSystemCount, min(workerCount, subSystemCount) + 1).astype(int)
+        self.workers, self.connections = [], []
+        try:
+            for first, last in zip(self.shardBounds[:-1], self.shardBounds[1:]):
+                parentEnd, workerEnd = mp.Pipe()
+                self.connections.append(parentEnd)
+                worker = mp.Process(target=runSubSystemShard, args=(self.points, self.distanceBlock.name, setup, slice(first, last), workerEnd), daemon=True)
+                worker.start()
+                workerEnd.close()
+                self.workers.append(worker)
+        except BaseException:
+            self.stopWorkers()
+            raise
+    
+    
+    def stopWorkers(self) -> None:
+        if self.workers is None: return
+        for connection in self.connections:
+            try:
+                connection.send(("stop", None))
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.distanceBlock.close()
+        self.distanceBlock.unlink()
+        self.workers = None
+    
+    
+    def sendToWorkers(self, command: str, payloads: list=None) -> None:
+        for i, connection in enumerate(self.connections):
+            try:
+                connection.send((command, None if payloads is None else payloads[i]))
+            except (BrokenPipeError, OSError):
+                # the worker has already stopped; its error is still waiting in the pipe
+                pass
+    
+    
+    def receiveFromWorkers(self) -> list:
+        # one reply per worker, in shard order; a worker's exception is raised here
+        replies = []
+        for worker, connection in zip(self.workers, self.connections):
+            try:
+                replies.append(connection.recv())
+            except EOFError:
+                replies.append(RuntimeError(f"slime mould worker {worker.pid} exited with code {worker.exitcode}"))
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+    
+    
+    def getConductivity(self) -> np.ndarray:
+        # every subsystem's conductivities, stacked in entry/exit pair order
+        if self.workers is not None:
+            self.sendToWorkers("get")
+            return np.concatenate(self.receiveFromWorkers())
+        if self.batched:
+            return self.batch.conductivity
+        return np.array([subSystem.conductivity for subSystem in self.subSystems])
+    
+    
+    def restoreState(self, conductivity: np.ndarray, iterationCleared: int) -> None:
+        self.iterationCleared = iterationCleared
+        if self.workers is not None:
+            self.sendToWorkers("set", [(conductivity[first:last], iterationCleared) for first, last in zip(self.shardBounds[:-1], self.shardBounds[1:])])
+        elif self.batched:
+            self.batch.conductivity = conductivity.astype(self.batch.dtype)
+        else:
+            for subSystem, subConductivity in zip(self.subSystems, conductivity):
+                subSystem.conductivity = subConductivity.copy()
+    
+    
+    def writeCheckpoint(self, filename: str, history: list[float]) -> None:
+        saveCheckpoint(filename, iteration=self.iterationCleared, history=np.array(history, dtype=np.float64), netEdgeFlux=self.netEdgeFlux, conductivity=self.getConductivity())
+    
+    
+    def readCheckpoint(self, filename: str) -> list[float]:
+        """Restores conductivities, netEdgeFlux, iteration counter and RNG state; returns the totalFlux history so far."""
+        state = loadCheckpoint(filename)
+        expected = self.getConductivity().shape
+        if state["conductivity"].shape != expected:
+            raise ValueError(f"{filename}: checkpoint conductivities {state['conductivity'].shape} do not match this setup {expected}")
+        self.restoreState(state["conductivity"], int(state["iteration"]))
+        self.netEdgeFlux = state["netEdgeFlux"]
+        return state["history"].tolist()
     
     
     def nextIteration(self, debug:bool=False) -> bool:
         # Simulate next Slime Mold Iteration for all subsystems
-        if self.iterationCleared >= self.maxIterations: return False
+        if self.iterationCleared >= self.maxIterations:
+            self.stopWorkers()
+            return False
+        
+        if self.workers is not None:
+            try:
+                self.sendToWorkers("step")
+                # only the partial sums travel back; they are added in shard order
+                partials = self.receiveFromWorkers()
+                self.netEdgeFlux = np.sum([partial[0] for partial in partials], axis=0)
+                self.fluxMagnitude = sum(partial[1] for partial in partials)
+            except BaseException:
+                self.stopWorkers()
+                raise
+            self.iterationCleared += 1
+            return True
+        
+        if self.batched:
+            contractionRate = gammaFunc(self.minContractionRate, self.maxContractionRate, self.transitionRate, self.maxIterations/3, self.iterationCleared)
+            self.netEdgeFlux = self.batch.nextIteration(contractionRate, self.fluxInfluence)
+            self.fluxMagnitude = self.batch.fluxMagnitude
+            self.iterationCleared += 1
+            return True
         
         self.netEdgeFlux = np.zeros((self.totalPoints, self.totalPoints))
+        self.fluxMagnitude = 0.0
         for i in range(len(self.subSystems)):
-            self.subSystems[i].calculatePressure()
-            self.subSystems[i].calculateFlux()
+            with self.timer.phase("calculatePressure"):
+                self.subSystems[i].calculatePressure()
+            with self.timer.phase("calculateFlux"):
+                self.subSystems[i].calculateFlux()
             
             # gamma =  a[1 - 1/[a/(a-b) + (ce^(T-t))]]
             contractionRate = gammaFunc(self.minContractionRate, self.maxContractionRate, self.transitionRate, self.maxIterations/3, self.iterationCleared)
-            self.subSystems[i].updateConductivity(contractionRate, self.fluxInfluence)
+            with self.timer.phase("updateConductivity"):
+                self.subSystems[i].updateConductivity(contractionRate, self.fluxInfluence)
         
             # Update the netEdgeFlux
             # Qij(t) = sum^{N(N-1)/2}_{k=1} (Qij^m(t))
             self.netEdgeFlux += self.subSystems[i].flux
+            self.fluxMagnitude += np.abs(self.subSystems[i].flux).sum() / 2
             if self.subSystems[i].flux.shape != (self.totalPoints, self.totalPoints):
                 print(f"({self.subSystems[i].startPoint}, {self.subSystems[i].endPoint}): Size note matching: size = {self.subSystems[i].flux.shape}, expected = ({self.totalPoints}, {self.totalPoints})")
         
@@ -148,20 +616,44 @@ class MultiStateSlimeMould:
         return True
     
     
-    def simulate(self, maxIterations: int, initialConductivity: float, totalFlux: float, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float, debug: bool):
+    def simulate(self, maxIterations: int, initialConductivity: float, totalFlux: float, fluxInfluence: float, minContractionRate: float, maxContractionRate: float, transitionRate: float, debug: bool, checkpoint: str=None, checkpointInterval: int=None, resume: bool=False, timer: PhaseTimer=None, callback=None, **storage):
+        # storage: batched, pairs, edgeList, dtype, chunkSize, memoryLimit and workers, as in setupSimulation;
+        # checkpoint is rewritten every "checkpointInterval" iterations and resume=True continues from it,
+        # which needs the same arguments as the interrupted run.
+        # timer: times whole iterations, and the SlimeMould phases of serial runs;
+        # callback(iteration, mssm) runs after each iteration
         if debug: print("Initiating Simulation Setup...")
-        self.setupSimulation(maxIterations, initialConductivity, totalFlux, fluxInfluence, minContractionRate, maxContractionRate, transitionRate)
+        self.setupSimulation(maxIterations, initialConductivity, totalFlux, fluxInfluence, minContractionRate, maxContractionRate, transitionRate, debug=debug, **storage)
         T = maxIterations / 3
         
+        totalFlux = []
         if debug: print("Initiating Simulation...")
-        while self.nextIteration(debug):
-            if debug: print("Iterations Cleared:", self.iterationCleared)
+        self.timer = timer or NULL_TIMER
+        self.timer.start()
+        try:
+            if resume:
+                totalFlux = self.readCheckpoint(checkpoint)
+            while self.iterationCleared < self.maxIterations:
+                with self.timer.phase("iteration"):
+                    self.nextIteration(debug)
+                totalFlux.append(self.fluxMagnitude)
+                if debug: print("Iterations Cleared:", self.iterationCleared)
+                if checkpointInterval and self.iterationCleared % checkpointInterval == 0:
+                    self.writeCheckpoint(checkpoint, totalFlux)
+                if callback is not None: callback(self.iterationCleared - 1, self)
+        finally:
+            self.stopWorkers()
+
+        return totalFlux
 
 
 def __SlimeMoldSim__():
     parser = argparse.ArgumentParser()
     parser.add_argument("-f",dest="filename",help="Filepath for the file containing city coordinates",required=True)
     parser.add_argument("--debug",dest="debug",action="store_true",help="Flag to enable print statements")
+    parser.add_argument("--prune",dest="pruneThreshold",type=float,help="Drop tubes whose conductivity falls below this value")
+    parser.add_argument("--pcg",dest="tolerance",type=float,help="Solve pressures with warm-started conjugate gradient to this tolerance")
+    parser.add_argument("--profile",dest="profile",action="store_true",help="Report the time spent in each phase")
     # parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
     # parser.add_argument("--iterationplot",dest="plotIterations",help="Save plot of optimal path length vs iterations")
 
@@ -174,19 +666,24 @@ def __SlimeMoldSim__():
     
     start = datetime.now()
     sma = SlimeMould(points, 0, len(points)-1, 100.0, 200.0)
-    sma.simulate(1000, 10.5, 0.2, 0.7, 1.2, args.debug)
+    if args.pruneThreshold is not None: sma.enablePruning(args.pruneThreshold)
+    if args.tolerance is not None: sma.enableIterativeSolver(args.tolerance)
+    timer = PhaseTimer() if args.profile else None
+    sma.simulate(1000, 10.5, 0.2, 0.7, 1.2, args.debug, timer=timer)
     end = datetime.now()
     print(end - start)
+    if timer is not None: print(timer.report())
     
-    flux = sma.flux
+    flux = sma.flux.toarray() if issparse(sma.flux) else sma.flux
     print(flux.sum())
-    plotweights(points, sma.flux, 10, sma.startPoint, sma.endPoint)
+    plotweights(points, flux, 10, sma.startPoint, sma.endPoint)
 
 
 def __SSMSim__():
     parser = argparse.ArgumentParser()
     parser.add_argument("-f",dest="filename",help="Filepath for the file containing city coordinates",required=True)
     parser.add_argument("--debug",dest="debug",action="store_true",help="Flag to enable print statements")
+    parser.add_argument("--profile",dest="profile",action="store_true",help="Report the time spent in each phase")
     # parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
     # parser.add_argument("--iterationplot",dest="plotIterations",help="Save plot of optimal path length vs iterations")
 
@@ -199,9 +696,11 @@ def __SSMSim__():
     
     start = datetime.now()
     mssm = MultiStateSlimeMould(points)
-    mssm.simulate(100, 100.0, 200.0, 10.5, 0.2, 0.7, 1.2, args.debug)
+    timer = PhaseTimer() if args.profile else None
+    mssm.simulate(100, 100.0, 200.0, 10.5, 0.2, 0.7, 1.2, args.debug, timer=timer)
     end = datetime.now()
     print(end - start)
+    if timer is not None: print(timer.report())
     
     print(mssm.netEdgeFlux.sum())
     plotweights(points, mssm.netEdgeFlux, 10, 0, 0)
@@ -1,103 +1,313 @@
 import numpy as np
 import argparse
+import sys
 from os import path
 from datetime import datetime
 
-from utils import readPoints, plot2DPath, plot3DPath, savePlot, clrscr, saveIterationPlot
+from utils import readPoints, plot2DPath, plot3DPath, savePlot, saveIterationPlot
+from localSearch import LocalSearch
+
+# modules shared with the slime mould code live one level up
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), ".."))
+from convergence import StoppingCriteria
+from geometry import pairwiseDistance
+from checkpoint import saveCheckpoint, loadCheckpoint
+from instrumentation import PhaseTimer, NULL_TIMER
+
+
+class AntPopulation:
+    # preallocated colony state, reused across iterations: one tour row per ant
+    def __init__(self, antCount: int, totalPoints: int) -> None:
+        self.totalPoints = totalPoints
+        self.paths = np.zeros((antCount, totalPoints + 1), dtype=np.int32)
+        self.visited = np.zeros((antCount, totalPoints), dtype=bool)
+        self.pathLengths = np.zeros(antCount, dtype=np.float64)
+        self.steps = np.zeros(antCount, dtype=np.intp)  # points placed on each tour so far
+
+    def reset(self, startPoints: np.ndarray) -> None:
+        self.visited[:] = False
+        self.paths[:, 0] = startPoints
+        self.visited[np.arange(len(self.paths)), startPoints] = True
+        self.pathLengths[:] = 0.0
+        self.steps[:] = 1
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: int) -> "Ant":
+        return Ant(self.paths[index, 0], self.totalPoints, self, index)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
 
 
 class Ant:
-    def __init__(self, startPoint: int, totalPoints: int) -> None:
-        self.currentPoint = startPoint
-        self.visited = [False] * totalPoints
-        self.visited[startPoint] = True
-        self.path = [startPoint]
-        # self.pathLength = 0.0
+    # thin view onto one row of an AntPopulation; Ant(startPoint, totalPoints) on its own
+    # builds a single-ant population, as the list-based Ant used to
+    def __init__(self, startPoint: int, totalPoints: int, population: AntPopulation = None, index: int = 0) -> None:
+        if population is None:
+            population = AntPopulation(1, totalPoints)
+            population.reset(np.array([startPoint]))
+        self.population, self.index = population, index
         self.totalPoints = totalPoints
 
+    @property
+    def currentPoint(self) -> int:
+        return int(self.population.paths[self.index, self.population.steps[self.index] - 1])
+
+    @property
+    def visited(self) -> np.ndarray:
+        return self.population.visited[self.index]
+
+    @property
+    def path(self) -> np.ndarray:
+        # a live view: item and slice assignment rewrite the tour in place (without touching
+        # visited); growing it goes through nextPoint/returnHome or assigning a whole path
+        return self.population.paths[self.index, : self.population.steps[self.index]]
+
+    @path.setter
+    def path(self, path: list[int]) -> None:
+        self.population.paths[self.index, : len(path)] = path
+        self.population.steps[self.index] = len(path)
+        self.population.visited[self.index] = False
+        self.population.visited[self.index, path] = True
+
+    @property
+    def pathLength(self) -> float:
+        return self.population.pathLengths[self.index]
+
+    @pathLength.setter
+    def pathLength(self, pathLength: float) -> None:
+        self.population.pathLengths[self.index] = pathLength
+
     def istourCompleted(self) -> bool:
-        return len(self.path) == self.totalPoints
+        return self.population.steps[self.index] == self.totalPoints
 
     def nextPoint(self, newPoint: int) -> bool:
         if self.visited[newPoint] or self.istourCompleted():
             return False
-        self.path.append(newPoint)
-        self.visited[newPoint] = True
-        self.currentPoint = newPoint
+        self.population.paths[self.index, self.population.steps[self.index]] = newPoint
+        self.population.visited[self.index, newPoint] = True
+        self.population.steps[self.index] += 1
         return True
 
     def returnHome(self) -> bool:
         if self.istourCompleted():
-            self.path.append(self.path[0])
+            self.population.paths[self.index, self.totalPoints] = self.population.paths[self.index, 0]
+            self.population.steps[self.index] += 1
             return True
         return False
 
     def calculatePathLength(self, distance: np.ndarray[np.float64]) -> float:  # type: ignore
-        self.pathLength = 0.0
-
-        for i in range(1, len(self.path)):
-            self.pathLength += distance[self.path[i - 1], self.path[i]]
-
+        path = self.population.paths[self.index, : self.population.steps[self.index]]
+        self.pathLength = distance[path[:-1], path[1:]].sum()
         return self.pathLength
 
 
 class AntSystem:
-    def __init__( self, antCount: int, points: np.ndarray, initialPheromones: float = 1.0 ) -> None:
+    # simulate records the best length going into each iteration, or coming out of it when set
+    historyAfterRoutes = False
+
+    def __init__( self, antCount: int, points: np.ndarray, initialPheromones: float = 1.0, candidateCount: int = None, distanceMatrix: np.ndarray = None ) -> None:
         self.totalPoints = len(points)
         self.antCount = antCount
         self.points = points
 
-        self.pheromones = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64) * initialPheromones
-        self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
-        
-        for i in range(self.totalPoints):
-            for j in range(self.totalPoints):
-                self.distance[i, j] = np.sqrt(np.sum((points[i] - points[j]) ** 2))
+        # candidate-list mode: only the k nearest points of each point are weighed,
+        # and distance/pheromones are stored for those (N x k) edges only
+        self.candidates = None
+        if candidateCount is not None and candidateCount < self.totalPoints - 1:
+            self.candidates, self.distance = self.nearestNeighbours(candidateCount)
+            self.pheromones = np.ones(self.candidates.shape, dtype=np.float64) * initialPheromones
+        else:
+            self.pheromones = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64) * initialPheromones
+            self.distance = pairwiseDistance(points) if distanceMatrix is None else distanceMatrix
 
         self.bestPath = None
         self.bestPathLength = np.inf
 
-    def initializeAntPopulation(self) -> None:
-        self.population = [ Ant(np.random.randint(self.totalPoints), self.totalPoints) for _ in range(self.antCount) ]
-
-    def constructRoutes(self, alpha: float, beta: float):
-        for ant in range(self.antCount):
-            while not self.population[ant].istourCompleted():
-                unvisited = np.where(np.logical_not(self.population[ant].visited))[0]
-                currentPoint = self.population[ant].currentPoint
+        # cached tau^alpha * eta^beta, read by constructRoutes
+        self.alpha, self.beta = None, None
+        self.heuristic = None
+        self.choiceInfo = None
 
-                transitionProb = np.zeros(len(unvisited), dtype=np.float64)
-                for i, point in enumerate(unvisited):
-                    transitionProb[i] = (self.pheromones[currentPoint, point] ** alpha) / (self.distance[currentPoint, point] ** beta)
+        self.localSearch, self.localSearchMode = None, None
+        self.population = AntPopulation(self.antCount, self.totalPoints)
 
-                transitionProb /= np.sum(transitionProb)
-                nextPoint = np.random.choice(unvisited, p=transitionProb)
-                self.population[ant].nextPoint(nextPoint)
+    def enableLocalSearch(self, mode: str = "best", neighbourCount: int = 10, moves: tuple[str, ...] = ("2-opt", "or-opt")) -> None:
+        # mode "all" improves every ant's tour after construction, "best" only the iteration-best one
+        if mode not in ("all", "best"):
+            raise ValueError(f"unknown local search mode: {mode}")
+        if self.candidates is not None:
+            neighbours = self.candidates[:, :neighbourCount]
+        else:
+            neighbours = np.argsort(self.distance, axis=1, kind="stable")[:, 1 : neighbourCount + 1]
+        self.localSearch = LocalSearch(self.points, neighbours, None if self.candidates is not None else self.distance, moves)
+        self.localSearchMode = mode
+
+    def nearestNeighbours(self, candidateCount: int) -> tuple[np.ndarray, np.ndarray]:
+        from scipy.spatial import cKDTree
+
+        distance, neighbours = cKDTree(self.points).query(self.points, k=candidateCount + 1)
+        # drop each point from its own list (it need not come first when points coincide)
+        notSelf = neighbours != np.arange(self.totalPoints)[:, None]
+        keep = np.argsort(~notSelf, axis=1, kind="stable")[:, :candidateCount]
+        return np.take_along_axis(neighbours, keep, axis=1), np.take_along_axis(distance, keep, axis=1)
+
+    def nearestUnvisited(self, currentPoints: np.ndarray, visited: np.ndarray) -> np.ndarray:
+        # full-scan fallback once every candidate of the current point is visited
+        distance = np.linalg.norm(self.points[None, :, :] - self.points[currentPoints, None, :], axis=2)
+        distance[visited] = np.inf
+        return np.argmin(distance, axis=1)
+
+    def tourLengths(self, paths: np.ndarray) -> np.ndarray:
+        if self.candidates is not None:
+            return np.linalg.norm(np.diff(self.points[paths], axis=1), axis=2).sum(axis=1)
+        return self.distance[paths[:, :-1], paths[:, 1:]].sum(axis=1)
+
+    def updateChoiceInfo(self, alpha: float, beta: float) -> None:
+        # eta^beta = distance^-beta never changes for a given beta
+        if self.heuristic is None or beta != self.beta:
+            with np.errstate(divide="ignore"):
+                self.heuristic = self.distance ** -beta
+            if self.candidates is None:
+                np.fill_diagonal(self.heuristic, 0.0)
+            self.beta = beta
+        self.alpha = alpha
+        self.choiceInfo = (self.pheromones if alpha == 1 else self.pheromones ** alpha) * self.heuristic
 
-            # returning home/starting-point
-            self.population[ant].returnHome()
+    def initializeAntPopulation(self) -> None:
+        self.population.reset(np.random.randint(self.totalPoints, size=self.antCount))
+
+    def sampleNextPoints(self, weights: np.ndarray, draws: np.ndarray = None) -> np.ndarray:
+        # inverse-CDF sampling, one row per ant: same rule as np.random.choice(p=...),
+        # so a given uniform draw always maps to the same point
+        cumulative = np.cumsum(weights, axis=1)
+        cumulative /= cumulative[:, -1:]
+        if draws is None:
+            draws = np.random.random_sample(len(weights))
+        return np.sum(cumulative <= draws[:, None], axis=1)
+
+    def transitionWeights(self, currentPoints: np.ndarray, columnsVisited: np.ndarray) -> np.ndarray:
+        # rows of the choice matrix for each ant's current point, visited columns zeroed;
+        # columns are points in dense mode and candidate slots in candidate-list mode
+        transitionWeights = self.choiceInfo[currentPoints]
+        transitionWeights[columnsVisited] = 0.0
+        # a row whose unvisited weights all underflowed (or overflowed) cannot be normalised;
+        # its ant picks uniformly among the unvisited columns instead
+        totals = transitionWeights.sum(axis=1)
+        stuck = ~np.isfinite(totals) | (totals <= 0.0)
+        if stuck.any():
+            transitionWeights[stuck] = ~columnsVisited[stuck]
+        return transitionWeights
 
-            pathLength = self.population[ant].calculatePathLength(self.distance)
-            if pathLength < self.bestPathLength:
-                self.bestPathLength = pathLength
-                self.bestPath = self.population[ant].path
+    def constructRoutes(self, alpha: float, beta: float):
+        # every ant moves forward in lockstep, one colony-wide step at a time
+        antIndex = np.arange(self.antCount)
+        paths, visited = self.population.paths, self.population.visited
+
+        if self.choiceInfo is None or (alpha, beta) != (self.alpha, self.beta):
+            self.updateChoiceInfo(alpha, beta)
+
+        for step in range(1, self.totalPoints):
+            currentPoints = paths[:, step - 1]
+
+            if self.candidates is None:
+                transitionWeights = self.transitionWeights(currentPoints, visited)
+                paths[:, step] = self.sampleNextPoints(transitionWeights)
+            else:
+                candidates = self.candidates[currentPoints]
+                candidateVisited = visited[antIndex[:, None], candidates]
+
+                exhausted = candidateVisited.all(axis=1)
+                choosing = ~exhausted
+                if choosing.any():
+                    transitionWeights = self.transitionWeights(currentPoints[choosing], candidateVisited[choosing])
+                    slots = self.sampleNextPoints(transitionWeights)
+                    paths[choosing, step] = candidates[choosing, slots]
+                if exhausted.any():
+                    paths[exhausted, step] = self.nearestUnvisited(currentPoints[exhausted], visited[exhausted])
+
+            visited[antIndex, paths[:, step]] = True
+
+        # returning home/starting-point
+        paths[:, -1] = paths[:, 0]
+
+        self.population.steps[:] = self.totalPoints + 1
+        pathLengths = self.population.pathLengths
+        pathLengths[:] = self.tourLengths(paths)
+
+        if self.localSearch is not None:
+            improving = range(self.antCount) if self.localSearchMode == "all" else [int(np.argmin(pathLengths))]
+            for ant in improving:
+                paths[ant], pathLengths[ant] = self.localSearch.improve(paths[ant].tolist())
+
+        iterationBest = int(np.argmin(pathLengths))
+        if pathLengths[iterationBest] < self.bestPathLength:
+            self.bestPathLength = pathLengths[iterationBest]
+            self.bestPath = paths[iterationBest].tolist()
+
+    def depositEdges(self, paths: np.ndarray, pathLengths: np.ndarray, pheromoneScaleFactor: float, symmetric: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # every tour's edges in one tour-major array, in the same order as the per-edge loop:
+        # the tour steps, then the "back to home" deposit on (path[-1], path[0])
+        edgesFrom = np.concatenate((paths[:, : self.totalPoints - 1], paths[:, -1:]), axis=1).ravel()
+        edgesTo = np.concatenate((paths[:, 1 : self.totalPoints], paths[:, :1]), axis=1).ravel()
+        deposits = np.repeat(pheromoneScaleFactor / pathLengths, self.totalPoints)
+
+        if symmetric:
+            edgesFrom, edgesTo = np.concatenate((edgesFrom, edgesTo)), np.concatenate((edgesTo, edgesFrom))
+            deposits = np.concatenate((deposits, deposits))
+        return edgesFrom, edgesTo, deposits
+
+    def depositPheromones(self, paths: np.ndarray, pathLengths: np.ndarray, pheromoneScaleFactor: float, symmetric: bool = False) -> None:
+        # single unbuffered scatter-add: repeated edges accumulate in loop order
+        edgesFrom, edgesTo, deposits = self.depositEdges(paths, pathLengths, pheromoneScaleFactor, symmetric)
+        if self.candidates is None:
+            np.add.at(self.pheromones, (edgesFrom, edgesTo), deposits)
+        else:
+            # deposits land only on edges that are in the candidate list
+            edges, slots = np.nonzero(self.candidates[edgesFrom] == edgesTo[:, None])
+            np.add.at(self.pheromones, (edgesFrom[edges], slots), deposits[edges])
 
-    def updatePheromones( self, evaporationRate: float, pheromoneScaleFactor: float) -> None:
+    def updatePheromones(self, evaporationRate: float, pheromoneScaleFactor: float, symmetric: bool = False) -> None:
         self.pheromones *= 1 - evaporationRate
-        for ant in range(self.antCount):
-            path = self.population[ant].path
-
-            pathLength = self.population[ant].pathLength
-            for i in range(1, self.totalPoints):
-                self.pheromones[path[i - 1], path[i]] += pheromoneScaleFactor / pathLength
-            # Back to home
-            self.pheromones[path[-1], path[0]] += pheromoneScaleFactor / pathLength
 
-    def simulate( self, maxIterations: int, alpha: float, beta: float, evaporationRate: float, pheromoneScaleFactor: float, debug: bool = False, ):
+        self.depositPheromones(self.population.paths, self.population.pathLengths, pheromoneScaleFactor, symmetric)
+
+        # pheromones only change here, so the choice matrix is rebuilt once per iteration
+        if self.alpha is not None:
+            self.updateChoiceInfo(self.alpha, self.beta)
+
+    def writeCheckpoint(self, filename: str, iteration: int, history: list[float]) -> None:
+        bestPath = np.array(self.bestPath if self.bestPath is not None else [], dtype=np.int64)
+        saveCheckpoint(filename, iteration=iteration, history=np.array(history, dtype=np.float64), pheromones=self.pheromones, bestPath=bestPath, bestPathLength=self.bestPathLength)
+
+    def readCheckpoint(self, filename: str) -> tuple[int, list[float]]:
+        """Restores pheromones, best path and RNG state; returns the iteration to continue from and the history so far."""
+        state = loadCheckpoint(filename)
+        if state["pheromones"].shape != self.pheromones.shape:
+            raise ValueError(f"{filename}: checkpoint pheromones {state['pheromones'].shape} do not match this colony {self.pheromones.shape}")
+        self.pheromones[...] = state["pheromones"]
+        self.bestPath = state["bestPath"].tolist() or None
+        self.bestPathLength = float(state["bestPathLength"])
+        if self.alpha is not None:
+            self.updateChoiceInfo(self.alpha, self.beta)
+        return int(state["iteration"]), state["history"].tolist()
+
+    def simulate( self, maxIterations: int, alpha: float, beta: float, evaporationRate: float, pheromoneScaleFactor: float, debug: bool = False, symmetricDeposit: bool = False, stopping: StoppingCriteria = None, checkpoint: str = None, checkpointInterval: int = None, resume: bool = False, timer: PhaseTimer = None, callback = None ):
+        # checkpoint: snapshot file, rewritten every "checkpointInterval" iterations;
+        # resume=True continues from it (stopping rules restart their windows)
+        # timer: accumulates constructRoutes/updatePheromones time; callback(iteration, colony) runs after each iteration
+        timer = timer or NULL_TIMER
+        timer.start()
         bestpathlength = []
-        for i in range(maxIterations):
-            if debug:
-                clrscr()
+        firstIteration = 0
+        if resume:
+            firstIteration, bestpathlength = self.readCheckpoint(checkpoint)
+        self.stopReason = "maxIterations"
+        if stopping is not None:
+            stopping.start()
+        for i in range(firstIteration, maxIterations):
             if debug:
                 print(f"Iteration: {i}/{maxIterations}")
 
@@ -106,12 +316,27 @@ class AntSystem:
             self.initializeAntPopulation()
             if debug:
                 print("Constructing Routes...")
-            bestpathlength.append(self.bestPathLength)
-            self.constructRoutes(alpha, beta)
+            if not self.historyAfterRoutes:
+                bestpathlength.append(self.bestPathLength)
+            with timer.phase("constructRoutes"):
+                self.constructRoutes(alpha, beta)
+            if self.historyAfterRoutes:
+                bestpathlength.append(self.bestPathLength)
             if debug:
                 print("Best Path Length:", self.bestPathLength)
                 print("Updating Pheromones...")
-            self.updatePheromones(evaporationRate, pheromoneScaleFactor)
+            with timer.phase("updatePheromones"):
+                self.updatePheromones(evaporationRate, pheromoneScaleFactor, symmetricDeposit)
+            if checkpointInterval and (i + 1) % checkpointInterval == 0:
+                self.writeCheckpoint(checkpoint, i + 1, bestpathlength)
+            if callback is not None:
+                callback(i, self)
+
+            if stopping is not None and stopping.check(self.bestPathLength, self.pheromones):
+                self.stopReason = stopping.reason
+                if debug:
+                    print("Stopping:", self.stopReason)
+                break
         return bestpathlength
 
 
@@ -121,6 +346,9 @@ def __main__():
     parser.add_argument("--debug",dest="debug",action="store_true",help="Flag to enable print statements")
     parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
     parser.add_argument("--iterationplot",dest="plotIterations",help="Save plot of optimal path length vs iterations")
+    parser.add_argument("--candidates",dest="candidateCount",type=int,help="Restrict each step to the k nearest points (for large point sets)")
+    parser.add_argument("--localsearch",dest="localSearch",choices=["all", "best"],help="Improve every tour, or the iteration-best tour, with 2-opt/Or-opt")
+    parser.add_argument("--profile",dest="profile",action="store_true",help="Report the time spent in each phase")
 
     args = parser.parse_args()
 
@@ -130,10 +358,15 @@ def __main__():
     points = readPoints(args.filename)
 
     start = datetime.now()
-    AS = AntSystem(antCount=100, points=points, initialPheromones=10.0)
-    pathLength = AS.simulate( maxIterations=1_000, alpha=1, beta=1, evaporationRate=0.36, pheromoneScaleFactor=200.0, debug=args.debug )
+    AS = AntSystem(antCount=100, points=points, initialPheromones=10.0, candidateCount=args.candidateCount)
+    if args.localSearch:
+        AS.enableLocalSearch(args.localSearch)
+    timer = PhaseTimer() if args.profile else None
+    pathLength = AS.simulate( maxIterations=1_000, alpha=1, beta=1, evaporationRate=0.36, pheromoneScaleFactor=200.0, debug=args.debug, timer=timer )
     end = datetime.now()
     print("run-time:", end - start)
+    if timer is not None:
+        print(timer.report())
 
     bestPath = AS.bestPath
     bestPathLength = AS.bestPathLength
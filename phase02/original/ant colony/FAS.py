@@ -1,143 +1,70 @@
 import numpy as np
 import argparse
 from os import path
-from math import gamma
 from datetime import datetime
 
-from utils import readPoints, plotPath, savePlot, clrscr, saveIterationPlot
+from utils import readPoints, plot2DPath, plot3DPath, savePlot, saveIterationPlot
+from AS import Ant, AntSystem as BaseAntSystem, PhaseTimer
 
 
-def fractionalTransitionProb(fractionalOrder: float, currentPoint: np.ndarray, transitionProb: np.ndarray[np.float64], unvisited: np.ndarray[np.intp], points: np.ndarray[np.dtype[np.float64]]):  # type: ignore
-    unvisitedPoints = points[unvisited]
-    prob = { tuple(unvisitedPoints[i]): transitionProb[i] for i in range(len(unvisitedPoints)) }
+def fractionalCoefficients(fractionalOrder: float, count: int) -> np.ndarray:
+    # |gamma(k - v) / (gamma(-v) * gamma(k + 1))| for k = 0 .. count-1, via the recurrence
+    # c_0 = 1, c_k = c_(k-1) * |k - 1 - v| / k, which never overflows unlike math.gamma
+    k = np.arange(1, count, dtype=np.float64)
+    return np.concatenate(([1.0], np.cumprod(np.abs(k - 1 - fractionalOrder) / k)))
 
-    unvisitedPoints = sorted( unvisitedPoints, key=lambda x: np.sqrt(np.sum((currentPoint - x) ** 2)) )
-    vGamma = gamma(-fractionalOrder)
-    gammaFactor = [ abs(gamma(k - fractionalOrder) / (vGamma * gamma(k + 1))) for k in range(len(unvisitedPoints)) ]
 
-    denominator = sum(gammaFactor)
-    numeratorFactor = sum( [ gammaFactor[i] * prob[tuple(unvisitedPoints[i])] for i in range(1, len(gammaFactor)) ] )
+class AntSystem(BaseAntSystem):
+    historyAfterRoutes = True
 
-    for key in prob.keys():
-        prob[key] = (prob[key] + numeratorFactor) / denominator
+    def __init__(self, antCount: int, points: np.ndarray, initialPheromones: float = 1.0, candidateCount: int = None, distanceMatrix: np.ndarray = None) -> None:
+        super().__init__(antCount, points, initialPheromones, candidateCount, distanceMatrix)
 
-    return prob
-
-
-class Ant:
-    def __init__(self, startPoint: int, totalPoints: int) -> None:
-        self.currentPoint = startPoint
-        self.visited = [False] * totalPoints
-        self.visited[startPoint] = True
-        self.path = [startPoint]
-        self.totalPoints = totalPoints
-
-    def istourCompleted(self) -> bool:
-        return len(self.path) == self.totalPoints
-
-    def nextPoint(self, newPoint: int) -> bool:
-        if self.visited[newPoint] or self.istourCompleted():
-            return False
-        self.path.append(newPoint)
-        self.visited[newPoint] = True
-        self.currentPoint = newPoint
-        return True
-
-    def returnHome(self) -> bool:
-        if self.istourCompleted():
-            self.path.append(self.path[0])
-            return True
-        return False
-
-    def calculatePathLength(self, distance: np.ndarray[np.float64]) -> float:  # type: ignore
-        self.pathLength = 0.0
-
-        for i in range(1, len(self.path)):
-            self.pathLength += distance[self.path[i - 1], self.path[i]]
-
-        return self.pathLength
-
-
-class AntSystem:
-    def __init__(self, antCount: int, points: np.ndarray, initialPheromones: float = 1.0) -> None:
-        self.totalPoints = len(points)
-        self.antCount = antCount
-        self.points = points
-
-        self.pheromones = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64) * initialPheromones
-            
-        self.distance = np.ones((self.totalPoints, self.totalPoints), dtype=np.float64)
-        for i in range(self.totalPoints):
-            for j in range(self.totalPoints):
-                self.distance[i, j] = np.sqrt(np.sum((points[i] - points[j]) ** 2))
-
-        self.bestPath = None
-        self.bestPathLength = np.inf
-
-    def initializeAntPopulation(self) -> None:
-        self.population = [ Ant(np.random.randint(self.totalPoints), self.totalPoints) for _ in range(self.antCount) ]
-
-    def constructRoutes(self, alpha: float, beta: float, fractionalOrder: float):
-        for ant in range(self.antCount):
-            while not self.population[ant].istourCompleted():
-                unvisited = np.where(np.logical_not(self.population[ant].visited))[0]
-                currentPoint = self.population[ant].currentPoint
-                
-                transitionProb = np.zeros(len(unvisited), dtype=np.float64)
-                for i, point in enumerate(unvisited):
-                    transitionProb[i] = (self.pheromones[currentPoint, point] ** alpha) / (self.distance[currentPoint, point] ** beta)
-
-                transitionProb /= np.sum(transitionProb)
-                fractionalProb = fractionalTransitionProb( fractionalOrder, self.points[currentPoint], transitionProb, unvisited, self.points, )
-
-                for i, point in enumerate(unvisited):
-                    transitionProb[i] = fractionalProb[tuple(self.points[point])]
-
-                transitionProb /= np.sum(transitionProb)
-                nextPoint = np.random.choice(unvisited, p=transitionProb)
-                self.population[ant].nextPoint(nextPoint)
-
-            # returning home/starting-point
-            self.population[ant].returnHome()
-
-            pathLength = self.population[ant].calculatePathLength(self.distance)
-            if pathLength < self.bestPathLength:
-                self.bestPathLength = pathLength
-                self.bestPath = self.population[ant].path
-
-    def updatePheromones(self, evaporationRate: float, pheromoneScaleFactor: float) -> None:
-        self.pheromones *= 1 - evaporationRate
-        for ant in range(self.antCount):
-            path = self.population[ant].path
-
-            pathLength = self.population[ant].pathLength
-            for i in range(1, self.totalPoints):
-                self.pheromones[path[i - 1], path[i]] += pheromoneScaleFactor / pathLength
-                
-            # Back to home
-            self.pheromones[path[-1], path[0]] += pheromoneScaleFactor / pathLength
-
-    def simulate( self, maxIterations: int, alpha: float, beta: float, fractionalOrder: float, evaporationRate: float, pheromoneScaleFactor: float, debug: bool = False ) -> list[float]:
-        bestPathLength = []
-        for i in range(maxIterations):
-            if debug:
-                clrscr()
-            if debug:
-                print(f"Iteration: {i}/{maxIterations}")
-
-            if debug:
-                print("Initializing Ant Population...")
-            self.initializeAntPopulation()
-            if debug:
-                print("Constructing Routes...")
-            self.constructRoutes(alpha, beta, fractionalOrder)
-            bestPathLength.append(self.bestPathLength)
-            if debug:
-                print("Best Path Length:", self.bestPathLength)
-                print("Updating Pheromones...")
-            self.updatePheromones(evaporationRate, pheromoneScaleFactor)
-
-        return bestPathLength
+        # each point's columns ordered by distance, computed once: candidate lists already
+        # come nearest-first, so only dense mode needs the argsort
+        if self.candidates is None:
+            self.neighbourOrder = np.argsort(self.distance, axis=1, kind="stable")
+        else:
+            self.neighbourOrder = None
+
+        self.fractionalOrder = None
+        self.coefficients = None
+
+    def updateFractionalCoefficients(self, fractionalOrder: float) -> None:
+        columns = self.totalPoints if self.candidates is None else self.candidates.shape[1]
+        self.coefficients = fractionalCoefficients(fractionalOrder, columns)
+        self.fractionalOrder = fractionalOrder
+
+    def transitionWeights(self, currentPoints: np.ndarray, columnsVisited: np.ndarray) -> np.ndarray:
+        transitionProb = super().transitionWeights(currentPoints, columnsVisited)
+        transitionProb /= transitionProb.sum(axis=1, keepdims=True)
+
+        # unvisited columns ranked by distance from the current point; the rank-k neighbour
+        # contributes c_k * p to every unvisited point's probability (k >= 1)
+        if self.neighbourOrder is None:
+            sortedProb, sortedUnvisited = transitionProb, ~columnsVisited
+        else:
+            order = self.neighbourOrder[currentPoints]
+            sortedProb = np.take_along_axis(transitionProb, order, axis=1)
+            sortedUnvisited = ~np.take_along_axis(columnsVisited, order, axis=1)
+
+        rank = np.cumsum(sortedUnvisited, axis=1) - 1
+        memory = np.where(sortedUnvisited & (rank > 0), self.coefficients[rank] * sortedProb, 0.0).sum(axis=1)
+
+        # dividing by sum(c_k) is left to the sampler's normalisation
+        return np.where(columnsVisited, 0.0, transitionProb + memory[:, None])
+
+    def constructRoutes(self, alpha: float, beta: float, fractionalOrder: float = None):
+        # without an order, the one set by the last call (or by simulate) is kept
+        if fractionalOrder is not None and fractionalOrder != self.fractionalOrder:
+            self.updateFractionalCoefficients(fractionalOrder)
+        super().constructRoutes(alpha, beta)
+
+    def simulate( self, maxIterations: int, alpha: float, beta: float, fractionalOrder: float, evaporationRate: float, pheromoneScaleFactor: float, *args, **kwargs ) -> list[float]:
+        # the remaining arguments are those of AntSystem.simulate
+        if fractionalOrder != self.fractionalOrder:
+            self.updateFractionalCoefficients(fractionalOrder)
+        return super().simulate(maxIterations, alpha, beta, evaporationRate, pheromoneScaleFactor, *args, **kwargs)
 
 
 def __main__():
@@ -146,6 +73,9 @@ def __main__():
     parser.add_argument("--debug", dest="debug", action="store_true", help="Flag to enable print statements")
     parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
     parser.add_argument("--iterationplot", dest="plotIterations", help="Save plot of optimal path length vs iterations")
+    parser.add_argument("--candidates", dest="candidateCount", type=int, help="Restrict each step to the k nearest points (for large point sets)")
+    parser.add_argument("--localsearch", dest="localSearch", choices=["all", "best"], help="Improve every tour, or the iteration-best tour, with 2-opt/Or-opt")
+    parser.add_argument("--profile", dest="profile", action="store_true", help="Report the time spent in each phase")
 
     args = parser.parse_args()
 
@@ -155,10 +85,15 @@ def __main__():
     points = readPoints(args.filename)
 
     start = datetime.now()
-    AS = AntSystem(antCount=100, points=points, initialPheromones=10.0)
-    pathLength = AS.simulate( maxIterations=1_000, alpha=1, beta=1, fractionalOrder=0.0000001, evaporationRate=0.36, pheromoneScaleFactor=200.0, debug=args.debug )
+    AS = AntSystem(antCount=100, points=points, initialPheromones=10.0, candidateCount=args.candidateCount)
+    if args.localSearch:
+        AS.enableLocalSearch(args.localSearch)
+    timer = PhaseTimer() if args.profile else None
+    pathLength = AS.simulate( maxIterations=1_000, alpha=1, beta=1, fractionalOrder=0.0000001, evaporationRate=0.36, pheromoneScaleFactor=200.0, debug=args.debug, timer=timer )
     end = datetime.now()
     print("run-time:", end - start)
+    if timer is not None:
+        print(timer.report())
 
     bestPath = AS.bestPath
     bestPathLength = AS.bestPathLength
@@ -168,8 +103,10 @@ def __main__():
     if bestPath:
         if args.saveplot:
             savePlot(points, bestPath, args.saveplot)
+        elif points.shape[1] == 3: # 3D points
+            plot3DPath(points, bestPath)
         else:
-            plotPath(points, bestPath)
+            plot2DPath(points, bestPath)
 
     if args.plotIterations:
         saveIterationPlot(pathLength, "Path Length", args.plotIterations)
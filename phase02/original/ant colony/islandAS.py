@@ -0,0 +1,206 @@
+import numpy as np
+import argparse
+import queue
+import threading
+import multiprocessing as mp
+from os import path
+from datetime import datetime
+
+from utils import readPoints, plot2DPath, plot3DPath, savePlot, saveIterationPlot
+from AS import AntSystem
+import FAS
+# AS puts the modules shared with the slime mould code on the path
+from sharedMemory import attachShared, createShared
+
+
+def runIsland(island: int, seed: int, points: np.ndarray, colony: dict, run: dict, sharedNames: dict, barrier, results) -> None:
+    try:
+        results.put(evolveIsland(island, seed, points, colony, run, sharedNames, barrier))
+    except Exception as error:
+        # release the islands waiting at the next migration and hand the failure to the parent
+        barrier.abort()
+        results.put((island, error))
+
+
+def evolveIsland(island: int, seed: int, points: np.ndarray, colony: dict, run: dict, sharedNames: dict, barrier) -> tuple:
+    np.random.seed(seed)
+    if colony["fractionalOrder"] is None:
+        AS = AntSystem(colony["antCount"], points, colony["initialPheromones"], colony["candidateCount"])
+    else:
+        AS = FAS.AntSystem(colony["antCount"], points, colony["initialPheromones"], colony["candidateCount"])
+    islandCount, totalPoints = run["islandCount"], len(points)
+
+    # this island's pheromones live in its slot of the shared block, so neighbours
+    # can read them at migration time without any N x N pickling
+    blocks = []
+    try:
+        pheromoneBlock, pheromones = attachShared(sharedNames["pheromones"], (islandCount, *AS.pheromones.shape), np.float64)
+        blocks.append(pheromoneBlock)
+        tourBlock, bestTours = attachShared(sharedNames["tours"], (islandCount, totalPoints + 1), np.intp)
+        blocks.append(tourBlock)
+        lengthBlock, bestLengths = attachShared(sharedNames["lengths"], (islandCount,), np.float64)
+        blocks.append(lengthBlock)
+        pheromones[island] = AS.pheromones
+        AS.pheromones = pheromones[island]
+
+        neighbour = (island - 1) % islandCount
+        bestPathLength = []
+        for i in range(run["maxIterations"]):
+            AS.initializeAntPopulation()
+            if colony["fractionalOrder"] is None:
+                AS.constructRoutes(run["alpha"], run["beta"])
+            else:
+                AS.constructRoutes(run["alpha"], run["beta"], colony["fractionalOrder"])
+            bestPathLength.append(AS.bestPathLength)
+            AS.updatePheromones(run["evaporationRate"], run["pheromoneScaleFactor"])
+
+            if (i + 1) % run["migrationInterval"] or i + 1 == run["maxIterations"]:
+                continue
+
+            # ring migration: publish, wait, read the neighbour, wait, then write
+            bestTours[island] = AS.bestPath
+            bestLengths[island] = AS.bestPathLength
+            barrier.wait()
+            if run["migration"] == "blend":
+                blended = (1 - run["blendFactor"]) * AS.pheromones + run["blendFactor"] * pheromones[neighbour]
+            else:
+                migrantTour, migrantLength = bestTours[neighbour].copy(), bestLengths[neighbour]
+            barrier.wait()
+
+            if run["migration"] == "blend":
+                AS.pheromones[...] = blended
+            else:
+                AS.depositPheromones(migrantTour[None, :], np.array([migrantLength]), run["pheromoneScaleFactor"])
+                if migrantLength < AS.bestPathLength:
+                    AS.bestPathLength, AS.bestPath = migrantLength, migrantTour.tolist()
+            AS.updateChoiceInfo(AS.alpha, AS.beta)
+
+        return island, AS.bestPath, float(AS.bestPathLength), [float(length) for length in bestPathLength]
+    finally:
+        # views into the blocks must go before the blocks can close
+        pheromones = bestTours = bestLengths = AS.pheromones = None
+        for block in blocks:
+            block.close()
+
+
+def simulateIslands(points: np.ndarray, islandCount: int, antCount: int, maxIterations: int, alpha: float, beta: float, evaporationRate: float, pheromoneScaleFactor: float, migrationInterval: int = 50, migration: str = "best", blendFactor: float = 0.25, initialPheromones: float = 1.0, candidateCount: int = None, fractionalOrder: float = None, seed: int = None):
+    """
+    Runs "islandCount" independent colonies in separate processes, each with its own random stream.
+    Every "migrationInterval" iterations each island receives its ring neighbour's best tour
+    (migration="best") or blends in its pheromone matrix (migration="blend").
+    Returns (best path, best path length, per-island best-path-length history).
+    """
+    if migration not in ("best", "blend"):
+        raise ValueError(f"unknown migration scheme: {migration}")
+    if islandCount < 1:
+        raise ValueError(f"islandCount must be positive, got {islandCount}")
+    if migrationInterval < 1:
+        raise ValueError(f"migrationInterval must be at least 1, got {migrationInterval}")
+
+    # the pheromone shape depends on the storage mode, so probe it from one colony
+    probe = AntSystem(1, points, initialPheromones, candidateCount)
+    pheromoneShape = probe.pheromones.shape
+    del probe
+
+    pheromoneBlock, _ = createShared((islandCount, *pheromoneShape), np.float64)
+    tourBlock, _ = createShared((islandCount, len(points) + 1), np.intp)
+    lengthBlock, _ = createShared((islandCount,), np.float64)
+    sharedNames = {"pheromones": pheromoneBlock.name, "tours": tourBlock.name, "lengths": lengthBlock.name}
+
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(islandCount)]
+    colony = {"antCount": antCount, "initialPheromones": initialPheromones, "candidateCount": candidateCount, "fractionalOrder": fractionalOrder}
+    run = {
+        "islandCount": islandCount, "maxIterations": maxIterations, "alpha": alpha, "beta": beta,
+        "evaporationRate": evaporationRate, "pheromoneScaleFactor": pheromoneScaleFactor,
+        "migrationInterval": migrationInterval, "migration": migration, "blendFactor": blendFactor,
+    }
+
+    barrier, results = mp.Barrier(islandCount), mp.Queue()
+    islands = [
+        mp.Process(target=runIsland, args=(island, seeds[island], points, colony, run, sharedNames, barrier, results))
+        for island in range(islandCount)
+    ]
+    try:
+        for process in islands:
+            process.start()
+        outcomes, silent = [], False
+        while len(outcomes) < islandCount:
+            try:
+                outcome = results.get(timeout=1.0)
+            except queue.Empty:
+                # an island killed outright (signal, out of memory) never reports back
+                for island, process in enumerate(islands):
+                    if not process.is_alive() and process.exitcode:
+                        raise RuntimeError(f"island {island} exited with code {process.exitcode}")
+                if not any(process.is_alive() for process in islands):
+                    if silent:
+                        raise RuntimeError("islands finished without reporting a result")
+                    silent = True
+                continue
+            if isinstance(outcome[1], BaseException):
+                # islands released from the barrier report BrokenBarrierError; keep the root cause
+                if not isinstance(outcome[1], threading.BrokenBarrierError):
+                    raise outcome[1]
+                continue
+            outcomes.append(outcome)
+        outcomes.sort()
+        for process in islands:
+            process.join()
+    finally:
+        barrier.abort()
+        for process in islands:
+            if process.is_alive():
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+        for block in (pheromoneBlock, tourBlock, lengthBlock):
+            block.close()
+            block.unlink()
+
+    bestIsland = min(outcomes, key=lambda outcome: outcome[2])
+    return bestIsland[1], bestIsland[2], [outcome[3] for outcome in outcomes]
+
+
+def __main__():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", dest="filename", help="Filepath for the file containing city coordinates", required=True)
+    parser.add_argument("--islands", dest="islandCount", type=int, default=mp.cpu_count(), help="Number of colonies, one process each")
+    parser.add_argument("--migration", dest="migration", choices=["best", "blend"], default="best", help="Exchange best tours or blend pheromone matrices")
+    parser.add_argument("--interval", dest="migrationInterval", type=int, default=50, help="Iterations between migrations")
+    parser.add_argument("--candidates", dest="candidateCount", type=int, help="Restrict each step to the k nearest points (for large point sets)")
+    parser.add_argument("--seed", dest="seed", type=int, help="Seed for the per-island random streams")
+    parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
+    parser.add_argument("--iterationplot", dest="plotIterations", help="Save plot of optimal path length vs iterations")
+
+    args = parser.parse_args()
+
+    if not path.isfile(args.filename):
+        print(f"{args.filename}: File Does Not Exist!")
+
+    points = readPoints(args.filename)
+
+    start = datetime.now()
+    bestPath, bestPathLength, history = simulateIslands(
+        points, args.islandCount, antCount=100, maxIterations=1_000, alpha=1, beta=1, evaporationRate=0.36, pheromoneScaleFactor=200.0,
+        migrationInterval=args.migrationInterval, migration=args.migration, initialPheromones=10.0, candidateCount=args.candidateCount, seed=args.seed,
+    )
+    end = datetime.now()
+    print("run-time:", end - start)
+
+    print("Best Path:", bestPath)
+    print("Best Path Length:", bestPathLength)
+
+    if bestPath:
+        if args.saveplot:
+            savePlot(points, bestPath, args.saveplot)
+        elif points.shape[1] == 3: # 3D points
+            plot3DPath(points, bestPath)
+        else:
+            plot2DPath(points, bestPath)
+
+    if args.plotIterations:
+        saveIterationPlot(np.min(history, axis=0), "Path Length", args.plotIterations)
+
+
+if __name__ == "__main__":
+    __main__()
@@ -0,0 +1,131 @@
+import numpy as np
+from collections import deque
+
+EPSILON = 1e-10
+
+
+class LocalSearch:
+    """
+    2-opt and Or-opt improvement of closed tours, restricted to each point's neighbour list
+    and driven by don't-look bits. The tour is kept as an array with a position index,
+    so every move is a slice reversal or a segment shift.
+    """
+
+    def __init__(self, points: np.ndarray, neighbours: np.ndarray, distance: np.ndarray = None, moves: tuple[str, ...] = ("2-opt", "or-opt"), maxSegment: int = 3) -> None:
+        self.points = points
+        self.neighbours = neighbours
+        self.distance = distance
+        self.moves = moves
+        self.maxSegment = maxSegment
+
+    def dist(self, a: int, b: int) -> float:
+        if self.distance is not None:
+            return self.distance[a, b]
+        return float(np.sqrt(np.sum((self.points[a] - self.points[b]) ** 2)))
+
+    def reverse(self, i: int, j: int) -> None:
+        # reverse tour positions i..j (cyclic); the complement is reversed instead when shorter
+        totalPoints = len(self.tour)
+        length = (j - i) % totalPoints + 1
+        if 2 * length > totalPoints:
+            i, j = (j + 1) % totalPoints, (i - 1) % totalPoints
+            length = totalPoints - length
+        index = (i + np.arange(length)) % totalPoints
+        self.tour[index] = self.tour[index[::-1]]
+        self.position[self.tour[index]] = index
+
+    def twoOpt(self, a: int) -> list[int] | None:
+        totalPoints = len(self.tour)
+        for forward in (True, False):
+            pa = self.position[a]
+            b = self.tour[(pa + 1) % totalPoints] if forward else self.tour[pa - 1]
+            dab = self.dist(a, b)
+            for c in self.neighbours[a]:
+                dac = self.dist(a, c)
+                if dac >= dab:
+                    break
+                pc = self.position[c]
+                d = self.tour[(pc + 1) % totalPoints] if forward else self.tour[pc - 1]
+                if c == b or d == a:
+                    continue
+                if dac + self.dist(b, d) - dab - self.dist(c, d) < -EPSILON:
+                    # remove (a, b), (c, d); add (a, c), (b, d)
+                    if forward:
+                        self.reverse(self.position[b], pc)
+                    else:
+                        self.reverse(pa, self.position[d])
+                    return [a, b, c, d]
+        return None
+
+    def orOpt(self, a: int) -> list[int] | None:
+        totalPoints = len(self.tour)
+        for segmentLength in range(1, self.maxSegment + 1):
+            if segmentLength + 2 >= totalPoints:
+                break
+            start = self.position[a]
+            segment = self.tour[(start + np.arange(segmentLength)) % totalPoints]
+            e = segment[-1]
+            p, n = self.tour[start - 1], self.tour[(start + segmentLength) % totalPoints]
+            removeGain = self.dist(p, a) + self.dist(e, n) - self.dist(p, n)
+            for c in self.neighbours[a]:
+                dac = self.dist(a, c)
+                if dac >= removeGain:
+                    break
+                if c in segment:
+                    continue
+                pc = self.position[c]
+                # a joins c on either side: c-a..e-succ(c) or pred(c)-e..a-c
+                for after in (True, False):
+                    other = self.tour[(pc + 1) % totalPoints] if after else self.tour[pc - 1]
+                    if other in segment:
+                        continue
+                    if dac + self.dist(e, other) - self.dist(c, other) - removeGain < -EPSILON:
+                        self.moveSegment(start, segmentLength, c, other, after)
+                        return [p, n, a, e, c, other]
+        return None
+
+    def moveSegment(self, start: int, segmentLength: int, c: int, other: int, after: bool) -> None:
+        totalPoints = len(self.tour)
+        # rotate so the segment sits at the front, then re-insert it next to c
+        rotated = np.roll(self.tour, -start)
+        segment, rest = rotated[:segmentLength], rotated[segmentLength:]
+        restPosition = np.empty(totalPoints, dtype=np.intp)
+        restPosition[rest] = np.arange(len(rest))
+        if after:
+            insertAt = restPosition[c] + 1
+        else:
+            insertAt, segment = restPosition[c], segment[::-1]
+        self.tour = np.concatenate((rest[:insertAt], segment, rest[insertAt:]))
+        self.position[self.tour] = np.arange(totalPoints)
+
+    def improve(self, path: list[int]) -> tuple[list[int], float]:
+        """Improves a closed tour (path[0] == path[-1]); returns the new path, starting at the same point, and its length."""
+        self.tour = np.asarray(path[:-1], dtype=np.intp).copy()
+        totalPoints = len(self.tour)
+        self.position = np.empty(totalPoints, dtype=np.intp)
+        self.position[self.tour] = np.arange(totalPoints)
+
+        # don't-look bits: only points next to a changed edge are queued again
+        queue, queued = deque(self.tour.tolist()), np.ones(totalPoints, dtype=bool)
+        while queue:
+            a = queue.popleft()
+            queued[a] = False
+            touched = None
+            if "2-opt" in self.moves:
+                touched = self.twoOpt(a)
+            if touched is None and "or-opt" in self.moves:
+                touched = self.orOpt(a)
+            if touched is None:
+                continue
+            for point in touched:
+                if not queued[point]:
+                    queued[point] = True
+                    queue.append(point)
+
+        tour = np.roll(self.tour, -self.position[path[0]])
+        closed = np.append(tour, tour[0])
+        if self.distance is not None:
+            length = self.distance[closed[:-1], closed[1:]].sum()
+        else:
+            length = np.linalg.norm(np.diff(self.points[closed], axis=0), axis=1).sum()
+        return closed.tolist(), length
@@ -1,7 +1,4 @@
 #!/bin/bash
 
-for i in {000..002}; do
-  filename="data/points3D_${i}.csv"
-  echo -e "\nSimulating On $filename"
-  python AS.py -f "$filename" --saveplot "data/path3D_${i}_as.png" --iterationplot "data/path3Dlength_${i}_as.png"
-done
+# runs every dataset in one worker pool; see ../batchRun.py -h for FAS/SMA/MSSM
+python ../batchRun.py "data/points3D_*.csv" -a AS -o "data/results_as.json" --plots data
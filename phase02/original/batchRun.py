@@ -0,0 +1,134 @@
+import argparse
+import csv
+import importlib
+import json
+import sys
+import multiprocessing as mp
+from glob import glob
+from os import path, makedirs
+from time import perf_counter
+
+from utils import readPoints
+from SMA import SlimeMould, MultiStateSlimeMould
+from geometry import DistanceCache
+
+ANT_COLONY_DIR = path.join(path.dirname(path.abspath(__file__)), "ant colony")
+ALGORITHMS = ["AS", "FAS", "SMA", "MSSM"]
+
+# one cache per worker process, so matrices it has already mapped are reused across tasks
+distanceCache = None
+
+
+def loadAntColonyModule(name: str):
+    # the ant colony scripts import their own utils.py, which shares its name with ours,
+    # so it is swapped in only while they are being imported
+    ownUtils = sys.modules.pop("utils", None)
+    sys.path.insert(0, ANT_COLONY_DIR)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(ANT_COLONY_DIR)
+        sys.modules.pop("utils", None)
+        if ownUtils is not None:
+            sys.modules["utils"] = ownUtils
+
+
+def initWorker(cacheDir: str) -> None:
+    global distanceCache
+    distanceCache = DistanceCache(cacheDir) if cacheDir else None
+
+
+def runExperiment(task: tuple[str, str, int]) -> dict:
+    """Runs one algorithm on one dataset with the same settings as the algorithm's own script."""
+    algorithm, filename, maxIterations = task
+    points = readPoints(filename)
+    distance = distanceCache.get(points) if distanceCache is not None else None
+    bestPath, bestPathLength = None, None
+
+    start = perf_counter()
+    if algorithm in ("AS", "FAS"):
+        module = loadAntColonyModule(algorithm)
+        colony = module.AntSystem(antCount=100, points=points, initialPheromones=10.0, distanceMatrix=distance)
+        if algorithm == "AS":
+            curve = colony.simulate(maxIterations=maxIterations, alpha=1, beta=1, evaporationRate=0.36, pheromoneScaleFactor=200.0)
+        else:
+            curve = colony.simulate(maxIterations=maxIterations, alpha=1, beta=1, fractionalOrder=0.0000001, evaporationRate=0.36, pheromoneScaleFactor=200.0)
+        bestPath, bestPathLength = [int(point) for point in colony.bestPath], float(colony.bestPathLength)
+    elif algorithm == "SMA":
+        sma = SlimeMould(points, 0, len(points) - 1, 100.0, 200.0, distance)
+        curve = sma.simulate(maxIterations, 10.5, 0.2, 0.7, 1.2)
+    else:
+        mssm = MultiStateSlimeMould(points, distance)
+        curve = mssm.simulate(maxIterations, 100.0, 200.0, 10.5, 0.2, 0.7, 1.2, False, batched=True)
+    runTime = perf_counter() - start
+
+    return {
+        "dataset": filename,
+        "algorithm": algorithm,
+        "bestPath": bestPath,
+        "bestPathLength": bestPathLength,
+        "runTime": runTime,
+        "curve": [float(value) for value in curve],
+    }
+
+
+def saveResults(results: list[dict], filename: str) -> None:
+    if filename.endswith(".csv"):
+        with open(filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["dataset", "algorithm", "bestPathLength", "runTime", "bestPath", "curve"])
+            for result in results:
+                bestPath = " ".join(map(str, result["bestPath"])) if result["bestPath"] else ""
+                writer.writerow([result["dataset"], result["algorithm"], result["bestPathLength"], result["runTime"], bestPath, " ".join(map(str, result["curve"]))])
+    else:
+        with open(filename, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+def savePlots(results: list[dict], plotDir: str) -> None:
+    antUtils = loadAntColonyModule("utils")
+    makedirs(plotDir, exist_ok=True)
+    for result in results:
+        stem = path.splitext(path.basename(result["dataset"]))[0]
+        prefix = path.join(plotDir, f"{stem}_{result['algorithm'].lower()}")
+        if result["bestPath"]:
+            antUtils.savePlot(readPoints(result["dataset"]), result["bestPath"], f"{prefix}_path.png")
+        label = "Path Length" if result["bestPath"] else "Total Flux"
+        antUtils.saveIterationPlot(result["curve"], label, f"{prefix}_curve.png")
+
+
+def __main__():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("datasets", help="Glob of dataset files, e.g. \"data/points3D_*.csv\"")
+    parser.add_argument("-a", dest="algorithm", choices=ALGORITHMS, default="AS", help="Algorithm to run (MSSM = multi-state slime mould)")
+    parser.add_argument("-o", dest="output", default="results.json", help="Results file (.json or .csv)")
+    parser.add_argument("-n", dest="maxIterations", type=int, help="Iterations per run (defaults to each algorithm's script default)")
+    parser.add_argument("--workers", dest="workers", type=int, default=mp.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--plots", dest="plotDir", help="Directory for path and iteration plots, drawn after all runs finish")
+    parser.add_argument("--cache", dest="cacheDir", help="Directory of cached distance matrices shared between runs")
+
+    args = parser.parse_args()
+
+    datasets = sorted(glob(args.datasets))
+    if not datasets:
+        print(f"{args.datasets}: No Matching Files!")
+        return
+
+    maxIterations = args.maxIterations or (100 if args.algorithm == "MSSM" else 1_000)
+    tasks = [(args.algorithm, dataset, maxIterations) for dataset in datasets]
+
+    results = []
+    with mp.Pool(min(args.workers, len(tasks)), initializer=initWorker, initargs=(args.cacheDir,)) as pool:
+        for result in pool.imap_unordered(runExperiment, tasks):
+            print(f"{result['dataset']}: {result['algorithm']} finished in {result['runTime']:.2f}s")
+            results.append(result)
+
+    results.sort(key=lambda result: result["dataset"])
+    saveResults(results, args.output)
+
+    if args.plotDir:
+        savePlots(results, args.plotDir)
+
+
+if __name__ == "__main__":
+    __main__()
@@ -0,0 +1,24 @@
+import numpy as np
+from os import path, replace, getpid
+
+
+def saveCheckpoint(filename: str, **state: np.ndarray) -> None:
+    """
+    Writes "state" and the global numpy RNG state to an .npz snapshot. The snapshot is
+    written under a private name and renamed, so a job killed mid-write leaves the
+    previous checkpoint intact.
+    """
+    name, keys, position, hasGauss, cachedGaussian = np.random.get_state()
+    partial = f"{filename}.{getpid()}.tmp.npz"
+    np.savez(partial, rngName=name, rngKeys=keys, rngPosition=position, rngHasGauss=hasGauss, rngCachedGaussian=cachedGaussian, **state)
+    replace(partial, filename)
+
+
+def loadCheckpoint(filename: str) -> dict[str, np.ndarray]:
+    """Reads a snapshot written by saveCheckpoint and restores the global numpy RNG state."""
+    if not path.isfile(filename):
+        raise FileNotFoundError(f"{filename}: No Checkpoint Found!")
+    with np.load(filename) as snapshot:
+        state = {key: snapshot[key] for key in snapshot.files}
+    np.random.set_state((str(state.pop("rngName")), state.pop("rngKeys"), int(state.pop("rngPosition")), int(state.pop("rngHasGauss")), float(state.pop("rngCachedGaussian"))))
+    return state
@@ -0,0 +1,80 @@
+import numpy as np
+from time import perf_counter
+from scipy.sparse import issparse
+
+
+def normalisedEntropy(weights: np.ndarray) -> float:
+    # mean Shannon entropy of each row's distribution, scaled to [0, 1]
+    if issparse(weights):
+        return sparseNormalisedEntropy(weights)
+    weights = np.abs(np.asarray(weights, dtype=np.float64))
+    if weights.ndim == 1:
+        weights = weights[None, :]
+    rowSums = weights.sum(axis=1, keepdims=True)
+    rows = rowSums[:, 0] > 0
+    if not rows.any() or weights.shape[1] < 2:
+        return 0.0
+    probabilities = weights[rows] / rowSums[rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(probabilities > 0, probabilities * np.log(probabilities), 0.0).sum(axis=1)
+    return float(entropy.mean() / np.log(weights.shape[1]))
+
+
+def sparseNormalisedEntropy(weights) -> float:
+    # normalisedEntropy over the stored entries only; the implicit zeros add nothing
+    weights = abs(weights.tocsr().astype(np.float64))
+    rowCount, columnCount = weights.shape
+    rowSums = np.asarray(weights.sum(axis=1)).ravel()
+    rows = rowSums > 0
+    if not rows.any() or columnCount < 2:
+        return 0.0
+    entryRows = np.repeat(np.arange(rowCount), np.diff(weights.indptr))
+    probabilities = weights.data / rowSums[entryRows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(probabilities > 0, probabilities * np.log(probabilities), 0.0)
+    entropy = -np.bincount(entryRows, weights=terms, minlength=rowCount)[rows]
+    return float(entropy.mean() / np.log(columnCount))
+
+
+class StoppingCriteria:
+    """
+    Stopping rules checked once per iteration; any rule left as None is disabled.
+    stagnationWindow      : stop when the tracked value has not changed for this many iterations
+    minImprovement        : stop when the relative change over "improvementWindow" iterations falls below this
+    entropyThreshold      : stop when the normalised entropy of the pheromone/conductivity matrix falls below this
+    timeBudget            : stop after this many wall-clock seconds
+    """
+
+    def __init__(self, stagnationWindow: int = None, minImprovement: float = None, improvementWindow: int = 50, entropyThreshold: float = None, timeBudget: float = None) -> None:
+        self.stagnationWindow = stagnationWindow
+        self.minImprovement = minImprovement
+        self.improvementWindow = improvementWindow
+        self.entropyThreshold = entropyThreshold
+        self.timeBudget = timeBudget
+        self.start()
+
+    def start(self) -> None:
+        self.startTime = perf_counter()
+        self.history = []
+        self.lastChange = 0
+        self.reason = None
+
+    def check(self, value: float, weights: np.ndarray = None) -> str | None:
+        """Records this iteration's tracked value and returns the name of the rule that fired, if any."""
+        iteration = len(self.history)
+        if self.history and not np.isclose(value, self.history[-1], rtol=1e-12, atol=0.0):
+            self.lastChange = iteration
+        self.history.append(value)
+
+        if self.timeBudget is not None and perf_counter() - self.startTime >= self.timeBudget:
+            self.reason = "timeBudget"
+        elif self.stagnationWindow is not None and iteration - self.lastChange >= self.stagnationWindow and np.isfinite(value):
+            self.reason = "stagnation"
+        elif self.minImprovement is not None and iteration >= self.improvementWindow:
+            previous = self.history[-1 - self.improvementWindow]
+            if np.isfinite(previous) and abs(previous - value) <= self.minImprovement * abs(previous):
+                self.reason = "minImprovement"
+        if self.reason is None and self.entropyThreshold is not None and weights is not None:
+            if normalisedEntropy(weights) <= self.entropyThreshold:
+                self.reason = "entropyCollapse"
+        return self.reason
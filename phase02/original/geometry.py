@@ -0,0 +1,58 @@
+import hashlib
+import numpy as np
+from os import path, makedirs, replace, getpid
+
+
+def pairwiseDistance(points: np.ndarray) -> np.ndarray:
+    """Euclidean distance between every pair of points, as an (N x N) matrix."""
+    points = np.asarray(points, dtype=np.float64)
+    return np.sqrt(np.sum((points[:, None, :] - points[None, :, :]) ** 2, axis=2))
+
+
+def fluxKernel(conductivity: np.ndarray, pressure: np.ndarray, distance: np.ndarray) -> np.ndarray:
+    """Qij = (Dij/Lij) * (pi - pj) from the outer pressure difference; also works on stacked (S x N x N) systems."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        flux = conductivity * (pressure[..., :, None] - pressure[..., None, :]) / distance
+    diagonal = np.arange(flux.shape[-1])
+    flux[..., diagonal, diagonal] = 0
+    return flux
+
+
+def defaultChunkSize(totalPoints: int) -> int:
+    """Subsystems per chunk so that the chunk's three float64 (N x N) work arrays take about 64 MiB."""
+    return max(1, (64 << 20) // (3 * totalPoints * totalPoints * 8))
+
+
+def datasetKey(points: np.ndarray) -> str:
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    digest = hashlib.sha256(str(points.shape).encode())
+    digest.update(points.tobytes())
+    return digest.hexdigest()
+
+
+class DistanceCache:
+    """
+    Content-addressed store of distance matrices: each matrix is saved once as
+    <directory>/<sha256 of the points>.npy and afterwards opened memory-mapped (read-only),
+    so runs of different algorithms on the same dataset share one computation.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.loaded = dict[str, np.ndarray]()
+        makedirs(directory, exist_ok=True)
+
+    def get(self, points: np.ndarray) -> np.ndarray:
+        key = datasetKey(points)
+        if key in self.loaded:
+            return self.loaded[key]
+
+        filename = path.join(self.directory, key + ".npy")
+        if not path.isfile(filename):
+            # written under a private name and renamed, so concurrent workers never read half a file
+            partial = path.join(self.directory, f"{key}.{getpid()}.tmp.npy")
+            np.save(partial, pairwiseDistance(points))
+            replace(partial, filename)
+
+        self.loaded[key] = np.load(filename, mmap_mode="r")
+        return self.loaded[key]
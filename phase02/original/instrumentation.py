@@ -0,0 +1,52 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+
+class PhaseTimer:
+    """
+    Cumulative wall-clock time and call count of named phases:
+        with timer.phase("calculateFlux"): ...
+    report() summarises them against the time since start().
+    """
+
+    def __init__(self) -> None:
+        self.start()
+
+    def start(self) -> None:
+        self.startTime = perf_counter()
+        self.totals = dict[str, float]()
+        self.counts = dict[str, int]()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + perf_counter() - start
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self) -> str:
+        elapsed = perf_counter() - self.startTime
+        lines = [f"{'phase':<20}{'calls':>8}{'total (s)':>12}{'mean (ms)':>12}{'share':>8}"]
+        for name, total in sorted(self.totals.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<20}{self.counts[name]:>8}{total:>12.3f}{1000 * total / self.counts[name]:>12.3f}{total / elapsed if elapsed else 0.0:>8.1%}")
+        lines.append(f"{'wall clock':<20}{'':>8}{elapsed:>12.3f}")
+        return "\n".join(lines)
+
+
+class NullTimer:
+    # stands in when timing is off: every phase is the same reusable no-op context
+    context = nullcontext()
+
+    def start(self) -> None:
+        pass
+
+    def phase(self, name: str):
+        return self.context
+
+    def report(self) -> str:
+        return ""
+
+
+NULL_TIMER = NullTimer()
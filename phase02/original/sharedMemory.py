@@ -0,0 +1,17 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def createShared(shape: tuple, dtype) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Allocates a named block for an array of "shape" and returns it with a view onto it. The
+    creator owns the block: it must close() and unlink() it once every process is done.
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def attachShared(name: str, shape: tuple, dtype) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Maps a block made by createShared in another process; drop the view before close()."""
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
@@ -1,52 +1,158 @@
-import random
+import sys
+import argparse
 import numpy as np
+from os import path
+from datetime import datetime
+
+# the fractional ant system (and its plotting helpers) live with the original algorithms
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), "original", "ant colony"))
+from utils import readPoints, plot2DPath, plot3DPath, savePlot, saveIterationPlot
+from FAS import AntSystem as FractionalAntSystem
+# importing FAS has put the shared modules of phase02/original on the path
+from geometry import defaultChunkSize
+
 
 def getEntryExitLoc(n, N):
-    totPairs = N * (N-1) / 2
-    possiblities = N-1
-    n_copy = n
-    while possiblities <= n:
-        n -= possiblities
-        possiblities -= 1
-    
-    indexI = N-1-possiblities
-    return indexI, indexI + n + 1
-    
-    
-
-def calculatePressure(D: list[list[float]], L: list[list[float]], I0: float, n: int):
-    N = len(D)
-    entryExitPairs = N * (N-1) / 2
-    netFlux = [[0]] * N
-    
-    x = [[-D[i][j]/L[i][j] for j in range(N)] for i in range(N)]
-    for i in range(N):
-        x[i][i] = -1 * sum(x[i])
-    
+    # subsystem n runs between points (i, j), i < j, numbered row by row over the upper triangle;
+    # inverting n = iN - i(i+1)/2 + (j - i - 1) gives i in closed form (n may be an array)
+    n = np.asarray(n, dtype=np.int64)
+    indexI = N - 2 - np.floor(np.sqrt(4 * N * (N - 1) - 8 * n - 7) / 2 - 0.5).astype(np.int64)
+    return indexI, n + indexI + 1 - N * (N - 1) // 2 + (N - indexI) * (N - indexI - 1) // 2
+
+
+def calculatePressure(D: np.ndarray, invL: np.ndarray, I0: float, n: np.ndarray) -> np.ndarray:
+    """
+    Pressures p^n (S x N) of the subsystems n with conductivities D (S x N x N); invL is 1/L with a zero diagonal.
+    The exit point of each subsystem is grounded (p = 0) and the systems are solved directly, never inverted.
+    """
+    S, N = D.shape[0], D.shape[1]
     entry, exit = getEntryExitLoc(n, N)
-    netFlux[entry][0], netFlux[exit][0] = I0, -I0
-    
-    pressure = np.linalg.inv(x) @ np.array(netFlux)
-    return pressure.T.tolist()[0]
-        
-
-def ssm(L: list[list[float]], Tmax: int, N: int):
-    entryExitPairs = N * (N-1) / 2
-    
-    # D[n][i][j] = conductivity for tube (i,j) in the nth subsystem
-    D = [[[random.random() for i in range(N)] for j in range(N)] for n in range(entryExitPairs)]
-    I0 = 5.0
-    
+    subSystems, diagonal = np.arange(S), np.arange(N)
+
+    coeff = D * invL
+    x = -coeff
+    x[:, diagonal, diagonal] = coeff.sum(axis=2)
+    x[subSystems, exit, :] = 0
+    x[subSystems, :, exit] = 0
+    x[subSystems, exit, exit] = 1
+
+    netFlux = np.zeros((S, N))
+    netFlux[subSystems, entry] = I0
+    return np.linalg.solve(x, netFlux[:, :, None])[:, :, 0]
+
+
+def ssmIteration(D: np.ndarray, invL: np.ndarray, I0: float, mu: float, gamma: float, chunkSize: int = None) -> np.ndarray:
+    """Advances every subsystem one step, updating D in place, and returns the net flux Q (N x N)."""
+    S, N = D.shape[0], D.shape[1]
+    chunkSize = chunkSize or S
+    Q = np.zeros((N, N))
+    for first in range(0, S, chunkSize):
+        chunk = slice(first, min(first + chunkSize, S))
+        p = calculatePressure(D[chunk], invL, I0, np.arange(chunk.start, chunk.stop))
+        # q^n_ij = D^n_ij / L_ij * (p^n_i - p^n_j)
+        q = D[chunk] * invL * (p[:, :, None] - p[:, None, :])
+        # D^n_ij = mu * |q^n_ij| + (1 - gamma) * D^n_ij
+        D[chunk] = mu * np.abs(q) + (1 - gamma) * D[chunk]
+        Q += q.sum(axis=0)
+    return Q
+
+
+def initialConductivity(N: int) -> np.ndarray:
+    # D[n][i][j] = conductivity for tube (i,j) in the nth subsystem, random and symmetric
+    D = np.triu(np.random.random((N * (N - 1) // 2, N, N)), 1)
+    return D + D.transpose(0, 2, 1)
+
+
+def ssm(L: np.ndarray, Tmax: int, I0: float = 5.0, mu: float = 1.0, gamma: float = 0.5, chunkSize: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """Runs the SSM on its own for Tmax iterations; returns the final D and the net flux Q of every iteration (Tmax x N x N)."""
+    if not 0 <= gamma < 1:
+        raise ValueError(f"gamma must lie in [0, 1), got {gamma}")
+    N = len(L)
+    with np.errstate(divide="ignore"):
+        invL = 1 / np.asarray(L, dtype=np.float64)
+    np.fill_diagonal(invL, 0)
+
+    D = initialConductivity(N)
     # Q[t][i][j] = net flux for tube (i,j) at t^th iteration
-    Q = [[[0 for i in range(N)] for j in range(N)] for n in range(entryExitPairs)]
-    
-    for t in range (Tmax):
-        for n in range(entryExitPairs):
-            # calculate p^n(t) at each node
-            pn = calculatePressure(D[n], L, I0, n)
-            # obtain q^n_ij(t)
-            # update conductivity D^n_ij
-            pass
-        # calculate Q_ij(t)
-        
-                
\ No newline at end of file
+    Q = np.zeros((Tmax, N, N))
+    for t in range(Tmax):
+        Q[t] = ssmIteration(D, invL, I0, mu, gamma, chunkSize or defaultChunkSize(N))
+    return D, Q
+
+
+class SSMFAS(FractionalAntSystem):
+    """
+    Fractional ant system coupled with the multi-state slime mould (SSM): every iteration the
+    N(N-1)/2 subsystems advance one step and the net flux reinforces the pheromones,
+    tau_ij = (1 - rho) * tau_ij + sum_k dtau^k_ij + fluxWeight * |Q_ij| / (S * I0).
+    """
+
+    def __init__(self, antCount: int, points: np.ndarray, initialPheromones: float = 1.0, I0: float = 5.0, mu: float = 1.0, gamma: float = 0.5, fluxWeight: float = 1.0, chunkSize: int = None, distanceMatrix: np.ndarray = None) -> None:
+        if not 0 <= gamma < 1:
+            raise ValueError(f"gamma must lie in [0, 1), got {gamma}")
+        super().__init__(antCount, points, initialPheromones, distanceMatrix=distanceMatrix)
+        self.I0, self.mu, self.gamma, self.fluxWeight = I0, mu, gamma, fluxWeight
+        self.chunkSize = chunkSize or defaultChunkSize(self.totalPoints)
+
+        with np.errstate(divide="ignore"):
+            self.invL = 1 / self.distance
+        np.fill_diagonal(self.invL, 0)
+        self.D = initialConductivity(self.totalPoints)
+        self.Q = list[np.ndarray]()
+
+    def updatePheromones(self, evaporationRate: float, pheromoneScaleFactor: float, symmetric: bool = False) -> None:
+        # replaces rather than extends the base update: the flux must be in place before
+        # the choice matrix is rebuilt, which happens once, at the end
+        self.pheromones *= 1 - evaporationRate
+        self.depositPheromones(self.population.paths, self.population.pathLengths, pheromoneScaleFactor, symmetric)
+
+        self.Q.append(ssmIteration(self.D, self.invL, self.I0, self.mu, self.gamma, self.chunkSize))
+        self.pheromones += self.fluxWeight * np.abs(self.Q[-1]) / (len(self.D) * self.I0)
+        if self.alpha is not None:
+            self.updateChoiceInfo(self.alpha, self.beta)
+
+    def run(self, maxIterations: int, alpha: float = 1, beta: float = 1, fractionalOrder: float = 0.0000001, evaporationRate: float = 0.36, pheromoneScaleFactor: float = 200.0, debug: bool = False) -> tuple[list[int], np.ndarray]:
+        """Returns the best tour found and the net flux Q of every iteration (iterations x N x N)."""
+        self.Q = []
+        self.bestPathLengths = self.simulate(maxIterations, alpha, beta, fractionalOrder, evaporationRate, pheromoneScaleFactor, debug)
+        return self.bestPath, np.array(self.Q)
+
+
+def __main__():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", dest="filename", help="Filepath for the file containing city coordinates", required=True)
+    parser.add_argument("-n", dest="maxIterations", type=int, default=200, help="Number of iterations")
+    parser.add_argument("--debug", dest="debug", action="store_true", help="Flag to enable print statements")
+    parser.add_argument("--saveplot", dest="saveplot", help="Save plots instead of displaying them")
+    parser.add_argument("--iterationplot", dest="plotIterations", help="Save plot of optimal path length vs iterations")
+
+    args = parser.parse_args()
+
+    if not path.isfile(args.filename):
+        print(f"{args.filename}: File Does Not Exist!")
+        return
+
+    points = readPoints(args.filename)
+
+    start = datetime.now()
+    colony = SSMFAS(antCount=100, points=points, initialPheromones=10.0)
+    bestPath, Q = colony.run(args.maxIterations, debug=args.debug)
+    end = datetime.now()
+    print("run-time:", end - start)
+    print("Best Path:", bestPath)
+    print("Best Path Length:", colony.bestPathLength)
+
+    if bestPath:
+        if args.saveplot:
+            savePlot(points, bestPath, args.saveplot)
+        elif points.shape[1] == 3: # 3D points
+            plot3DPath(points, bestPath)
+        else:
+            plot2DPath(points, bestPath)
+
+    if args.plotIterations:
+        saveIterationPlot(colony.bestPathLengths, "Path Length", args.plotIterations)
+
+
+if __name__ == "__main__":
+    __main__()